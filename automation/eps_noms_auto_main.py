@@ -1,15 +1,144 @@
 # Primary libraries
+import argparse
+import asyncio
+import contextlib
+import cProfile
 import csv
+import hashlib
+import html
+import io
+import json
+import multiprocessing
 import os
+import queue
+import re
+import resource
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
+from itertools import islice, takewhile, zip_longest
+from urllib.parse import urljoin, urlparse
 
 # 3rd party libraries
-import openpyxl
-import requests
-from bs4 import BeautifulSoup
-from google.cloud import storage
+from eps_noms_lazy import LazyModule
+from eps_noms_readers import WORKBOOK_READERS, XmlReader, check_reader_parity, open_workbook_reader
+from eps_noms_sinks import (PARQUET_COMPRESSION, UPLOAD_CHUNK_SIZE, BigQueryContext, BigQueryRowWriter,
+                            ParquetRowWriter, UploadStream, get_column_names, get_dictionary_columns, upload_to_gcp)
+from eps_noms_transport import GCS_HOST, GCS_TIMEOUT, CircuitOpenError, transport
 
-def authentication():
+google_exceptions = LazyModule('google.api_core.exceptions')
+np = LazyModule('numpy')
+openpyxl = LazyModule('openpyxl')
+pa = LazyModule('pyarrow')
+pd = LazyModule('pandas')
+pq = LazyModule('pyarrow.parquet')
+requests = LazyModule('requests')
+storage = LazyModule('google.cloud.storage')
+
+# Config
+BASE_URL = "https://digital.nhs.uk/services/electronic-prescription-service/statistics"
+BASE_FILENAME = "eps_nom_report+"  # Note the + here
+GCP_BUCKET_NAME = "phlo-sandpit-raw-data-lake"
+BLOB_PREFIX = "sources/reference-data/nhs-eps-noms/"
+DELTA_BLOB_PREFIX = "sources/reference-data/nhs-eps-noms-deltas/"
+DELTA_FILENAME = "eps_nom_delta+"
+QUARANTINE_BLOB_PREFIX = "sources/reference-data/nhs-eps-noms-quarantine/"
+QUARANTINE_FILENAME = "eps_nom_quarantine+"
+QUARANTINE_MAX_FRACTION = 0.05  # More rows than this failing validation means the layout has changed
+QUARANTINE_MIN_ROWS = 100  # Rows read before the fraction is applied
+MANIFEST_BLOB_NAME = f"{BLOB_PREFIX}_manifest.json"
+MANIFEST_FILE = 'manifest.json'  # Local mirror of the bucket manifest
+
+DISPENSER_SHEET = 'Dispenser Nominations'
+LPC_COLUMN_TITLE = 'Local Pharmaceutical Committee (LPC)'
+DISPENSER_KEY_COLUMN = 'Dispenser Name'  # The data ends at the first row without one
+DISPENSER_KEY_DEFAULT_INDEX = 1  # Column B, used if no header matches DISPENSER_KEY_COLUMN
+DELTA_KEY_COLUMN = 'Dispenser Code'  # ODS code of the pharmacy
+DELTA_CHANGE_COLUMN = 'Change'
+
+# Columns found by header rather than position and validated when present:
+# (column, header it is or starts with, type, required)
+# Only the LPC column, whose title the report is known to use, is required
+DISPENSER_SCHEMA = [
+    ('Dispenser Code', 'dispenser code', 'code', False),
+    (DISPENSER_KEY_COLUMN, 'dispenser name', 'text', False),
+    ('Address', 'address', 'text', False),
+    ('Postcode', 'postcode', 'text', False),
+    ('Region', 'region', 'text', False),
+    ('ICB', 'icb', 'text', False),
+    ('Nominations', 'nominations', 'count', False),
+    (LPC_COLUMN_TITLE, 'local pharmaceutical committee', 'text', True),
+    ('Dispenser Type', 'dispenser type', 'text', False),
+]
+
+# String columns stay dictionary encoded in memory while at most this share of their values are distinct
+DICTIONARY_MAX_RATIO = 0.5
+DICTIONARY_CHECK_INTERVAL = 4096
+
+DOWNLOAD_METADATA_FILE = 'download_metadata.json'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+HTTP_TIMEOUT = (10, 60)  # (connect, read) seconds
+
+LINK_INDEX_FILE = 'link_index.json'
+CONTENT_CACHE_DIR = 'workbook_cache'
+CONTENT_CACHE_SIZE = 512 * 1024 * 1024
+PROFILE_FILE = 'eps_noms_profile.pstats'
+DAEMON_POLL_INTERVAL = 15  # Minutes between statistics page checks while a release is due
+
+PIPELINE_BATCH_SIZE = 1000  # Rows handed from the reader thread to the upload stream at a time
+PIPELINE_QUEUE_SIZE = 64  # Batches buffered between them before the reader blocks
+
+# Peak RSS per byte of xlsx for each engine, measured on generated reports
+REPROCESS_MEMORY_FACTORS = {'legacy': 120, 'frame': 10, 'stream': 4}
+REPROCESS_PROCESS_MEMORY = 150 * 1024 * 1024  # Interpreter and libraries in each worker process
+REPROCESS_START_METHOD = 'spawn'
+REPROCESS_TASKS_PER_CHILD = 1  # Fresh process per workbook, so openpyxl's memory goes back to the OS
+REPROCESS_SOURCE_PATTERN = re.compile(r'eps_nom_report[-+](\d{6})\.xlsx$')
+
+# Matches href="...eps_nom_report-YYMMDD.xlsx" (also + or %2B in place of -)
+REPORT_HREF_PATTERN = re.compile(
+    r"""href\s*=\s*["']([^"']*eps_nom_report(?:-|\+|%2B)(\d{6})\.xlsx[^"']*)["']""",
+    re.IGNORECASE,
+)
+
+class StorageContext:
+    """
+    Storage client and bucket handle created once per run and shared by every
+    bucket operation, so credentials and the connection pool are only set up once.
+    Pass a client to use a local fake GCS server or an in-memory stand-in
+    (storage.Client also honours STORAGE_EMULATOR_HOST).
+    """
+    def __init__(self, bucket_name, client=None):
+        self.bucket_name = bucket_name
+        self._client = client
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = storage.Client()
+            return self._client
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = self.client.bucket(self.bucket_name)
+        return self._bucket
+
+    def blob(self, blob_name):
+        return self.bucket.blob(blob_name)
+
+def authentication(storage_context):
     """
     Set up Google Cloud auth using service account key.
     """
@@ -22,80 +151,112 @@ def authentication():
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = service_account_path
         
         # Testing auth
-        storage_client = storage.Client()
-        print("Authentication successful with project:", storage_client.project)
+        print("Authentication successful with project:", storage_context.client.project)
         return True
     except Exception as e:
         print(f"Authentication error: {e}")
         return False
 
-def list_bucket_files(bucket_name, prefix=None):
+def list_bucket_files(storage_context, prefix=None):
     """
     Lists all files in the specified GCP bucket.
     """
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blobs = bucket.list_blobs(prefix=prefix)
+        blobs = transport.call(
+            GCS_HOST, lambda: list(storage_context.bucket.list_blobs(prefix=prefix, timeout=GCS_TIMEOUT, retry=None)))
         
         files = [blob.name for blob in blobs]
-        print(f"Found {len(files)} files in bucket {bucket_name} with prefix {prefix if prefix else 'none'}")
+        print(f"Found {len(files)} files in bucket {storage_context.bucket_name} with prefix {prefix if prefix else 'none'}")
         return files
     except Exception as e:
         print(f"Error checking bucket contents: {e}")
-        print(f"Bucket: {bucket_name}")
-        print(f"Project: {storage_client.project}")
+        print(f"Bucket: {storage_context.bucket_name}")
         return []
 
-def check_file_exists(bucket_name, blob_name):
+def check_file_exists(storage_context, blob_name):
     """
     Check if file exists in bucket.
     """ 
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        
-        exists = blob.exists()
+        exists = transport.call(GCS_HOST, storage_context.blob(blob_name).exists, timeout=GCS_TIMEOUT, retry=None)
         if exists:
-            print(f"File {blob_name} already exists {bucket_name}")
+            print(f"File {blob_name} already exists {storage_context.bucket_name}")
         return exists
     except Exception as e:
         print(f"Error checking file existence: {e}")
         return False
 
-def get_latest_processed_date(bucket_name, prefix=None):
+def parse_processed_date(filename):
     """
-    Get most recent processed file date from bucket.
+    Get the report date from a processed file name, or None if it is not one.
     Note: Looking for + in filename, not -
     """
+    # Changed to look for the new filename format
+    if 'eps_nom_report+' not in filename:
+        return None
     try:
-        files = list_bucket_files(bucket_name, prefix)
-        # Changed to look for the new filename format
-        processed_files = [f for f in files if 'eps_nom_report+' in f]
-        
-        if not processed_files:
-            print("No processed files found in bucket")
-            return None
-        
-        dates = []
-        for filename in processed_files:
-            try:
-                # Split on + instead of -
-                date_str = filename.split('+')[1][:6]  # Extract YYMMDD
-                date = datetime.strptime(date_str, '%y%m%d')
-                dates.append(date)
-            except (IndexError, ValueError):
-                continue
-        
-        if dates:
-            latest_date = max(dates)
-            print(f"Latest processed file date: {latest_date.strftime('%Y-%m-%d')}")
-            return latest_date
+        # Split on + instead of -
+        date_str = filename.split('+')[1][:6]  # Extract YYMMDD
+        return datetime.strptime(date_str, '%y%m%d')
+    except (IndexError, ValueError):
         return None
+
+def load_manifest(storage_context, manifest_file=MANIFEST_FILE):
+    """
+    Load the manifest of processed weeks with a single read from the bucket,
+    mirroring it locally. The first time it is built from a bucket listing.
+    Falls back to the local mirror if the bucket cannot be read.
+    """
+    try:
+        manifest = json.loads(transport.call(GCS_HOST, storage_context.blob(MANIFEST_BLOB_NAME).download_as_bytes,
+                                             timeout=GCS_TIMEOUT, retry=None))
+        print(f"Loaded manifest {MANIFEST_BLOB_NAME} ({len(manifest['weeks'])} weeks)")
+    except google_exceptions.NotFound:
+        print(f"No manifest found at {MANIFEST_BLOB_NAME}, building it from bucket listing")
+        manifest = {'weeks': {}}
+        for filename in list_bucket_files(storage_context, BLOB_PREFIX):
+            processed_date = parse_processed_date(filename)
+            if processed_date is not None:
+                manifest['weeks'][processed_date.strftime('%Y-%m-%d')] = {'blob': filename}
     except Exception as e:
-        print(f"Error getting latest processed date: {e}")
-        return None
+        print(f"Error loading manifest from bucket, using local copy: {e}")
+        return load_json_cache(manifest_file) or {'weeks': {}}
+
+    save_json_cache(manifest, manifest_file)
+    return manifest
+
+def save_manifest(storage_context, manifest, manifest_file=MANIFEST_FILE):
+    """
+    Save the manifest locally and to the bucket.
+    Weeks recorded by other runs since it was loaded are kept.
+    """
+    try:
+        blob = storage_context.blob(MANIFEST_BLOB_NAME)
+        try:
+            current = json.loads(transport.call(GCS_HOST, blob.download_as_bytes, timeout=GCS_TIMEOUT, retry=None))
+            manifest['weeks'] = {**current['weeks'], **manifest['weeks']}
+        except google_exceptions.NotFound:
+            pass
+        save_json_cache(manifest, manifest_file)
+        transport.call(GCS_HOST, blob.upload_from_string, json.dumps(manifest, indent=2, sort_keys=True),
+                       content_type='application/json', timeout=GCS_TIMEOUT, retry=None)
+        print(f"Saved manifest {MANIFEST_BLOB_NAME} ({len(manifest['weeks'])} weeks)")
+        return True
+    except Exception as e:
+        print(f"Error saving manifest: {e}")
+        return False
+
+def get_manifest_dates(manifest):
+    """
+    Get the set of report dates recorded in the manifest.
+    """
+    return {datetime.strptime(week, '%Y-%m-%d') for week in manifest['weeks']}
+
+def record_processed_week(manifest, report_date, entry):
+    """
+    Record a processed week (blob, row count, checksum, source URL) in the manifest.
+    """
+    manifest['weeks'][report_date.strftime('%Y-%m-%d')] = entry
 
 def get_latest_report_date():
     """
@@ -119,6 +280,29 @@ def get_latest_report_date():
 
     return previous_friday
 
+def get_next_release_time(report_date):
+    """
+    Start of the Monday on which the report after report_date is released.
+    """
+    next_release = report_date + timedelta(days=10)  # Friday -> the Monday after next
+    return datetime(next_release.year, next_release.month, next_release.day)
+
+def get_report_dates(start_date, end_date):
+    """
+    Get every report date (Friday) between start_date and end_date inclusive.
+    Dates after the latest released report are left out.
+    """
+    end_date = min(end_date, get_latest_report_date())
+    first_friday = start_date + timedelta(days=(4 - start_date.weekday()) % 7)
+    first_friday = datetime(first_friday.year, first_friday.month, first_friday.day)
+
+    report_dates = []
+    report_date = first_friday
+    while report_date.date() <= end_date.date():
+        report_dates.append(report_date)
+        report_date += timedelta(days=7)
+    return report_dates
+
 def generate_filename(base_name, date):
     """
     Generate filename with date format.
@@ -128,53 +312,294 @@ def generate_filename(base_name, date):
     date_str = date.strftime("%y%m%d")
     return f"{base_name.replace('+', '-')}{date_str}.xlsx"
 
-def download_excel(url, local_filename):
+def create_http_session():
+    """
+    Create the HTTP session shared by every request in the run (keep-alive).
+    """
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'eps-noms-auto'})
+    return session
+
+def load_json_cache(cache_file):
+    """
+    Load a local JSON cache file, or an empty dict if it is missing or unreadable.
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache file {cache_file}: {e}")
+        return {}
+
+def save_json_cache(data, cache_file):
+    """
+    Atomically write a local JSON cache file.
+    Each write goes through its own temp file, so concurrent writers never
+    replace each other's half-written file.
+    """
+    descriptor, temp_file = tempfile.mkstemp(prefix=f"{os.path.basename(cache_file)}.",
+                                             suffix='.tmp', dir=os.path.dirname(cache_file) or '.')
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=2, sort_keys=True)
+        os.replace(temp_file, cache_file)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_file)
+        raise
+
+download_metadata_lock = threading.Lock()
+
+def update_download_metadata(metadata_file, download_url, cached):
+    """
+    Record the validators of one download in the metadata file.
+    The read-modify-write is done under a lock so backfill threads
+    downloading other weeks do not drop each other's entries.
+    """
+    with download_metadata_lock:
+        metadata = load_json_cache(metadata_file)
+        metadata[download_url] = cached
+        save_json_cache(metadata, metadata_file)
+
+def file_sha256(filename):
+    """
+    SHA-256 hex digest of a local file.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ContentCache:
+    """
+    Local content-addressed store of downloaded workbooks, keyed by SHA-256,
+    each with the manifest entry (including the output hashes) it produced.
+    The least recently used workbooks are evicted once the cache grows past max_bytes.
+    """
+    def __init__(self, cache_dir=CONTENT_CACHE_DIR, max_bytes=CONTENT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = load_json_cache(self.index_file)
+        self._lock = threading.Lock()
+
+    def _path(self, sha256):
+        return os.path.join(self.cache_dir, f"{sha256}.xlsx")
+
+    def lookup(self, sha256, week, output_format):
+        """
+        Get the manifest entry produced from this workbook for the same week and
+        output format, or None.
+        """
+        with self._lock:
+            item = self._index.get(sha256)
+            if (item is None or item['week'] != week or item['output_format'] != output_format
+                    or not os.path.exists(self._path(sha256))):
+                return None
+            item['last_used'] = time.time()
+            save_json_cache(self._index, self.index_file)
+            return item['entry']
+
+    def add(self, filename, sha256, week, output_format, entry):
+        """
+        Store a processed workbook and the manifest entry it produced.
+        """
+        with self._lock:
+            path = self._path(sha256)
+            if not os.path.exists(path):
+                # Downloads replace the working file rather than rewriting it, so a hard link is safe
+                try:
+                    os.link(filename, path)
+                except OSError:
+                    shutil.copyfile(filename, path)
+            self._index[sha256] = {
+                'week': week,
+                'output_format': output_format,
+                'size': os.path.getsize(path),
+                'last_used': time.time(),
+                'entry': entry,
+            }
+            self._evict()
+            save_json_cache(self._index, self.index_file)
+
+    def _evict(self):
+        total_size = sum(item['size'] for item in self._index.values())
+        for sha256, item in sorted(self._index.items(), key=lambda item: item[1]['last_used']):
+            if total_size <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(sha256))
+            del self._index[sha256]
+            total_size -= item['size']
+            print(f"Evicted workbook {sha256} ({item['week']}) from {self.cache_dir}")
+
+def download_file(session, download_url, local_filename, metadata_file=DOWNLOAD_METADATA_FILE):
+    """
+    Stream a file to disk in chunks.
+    - Sends If-None-Match/If-Modified-Since so an unchanged file costs a 304
+    - Resumes a partial download with a Range request when a dropped
+      connection is retried by the transport
+    """
+    with download_metadata_lock:
+        cached = load_json_cache(metadata_file).get(download_url, {})
+    part_filename = f"{local_filename}.part"
+
+    def attempt_download():
+        nonlocal cached
+        headers = {'Accept-Encoding': 'identity'}  # Byte ranges must match the file on disk
+        offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+        if offset and not cached.get('complete'):
+            # Only resume if the server still has the same version of the file
+            validator = cached.get('etag') or cached.get('last_modified')
+            if validator:
+                headers['Range'] = f"bytes={offset}-"
+                headers['If-Range'] = validator
+        elif cached.get('complete') and os.path.exists(local_filename):
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        with session.get(download_url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+            if response.status_code == 304:
+                print(f"File not modified since last download, using {local_filename}")
+                return True
+            if response.status_code == 416:
+                # Partial file no longer matches the remote file, start again
+                os.remove(part_filename)
+                raise requests.ConnectionError(f"Partial download of {download_url} no longer matches, restarting")
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                mode = 'ab'
+                total_size = response.headers.get('Content-Range', '').rpartition('/')[2]
+                expected_size = int(total_size) if total_size.isdigit() else 0
+                print(f"Resuming download at byte {offset}")
+            else:
+                mode = 'wb'
+                expected_size = int(response.headers.get('Content-Length') or 0)
+                cached = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'complete': False,
+                }
+                update_download_metadata(metadata_file, download_url, cached)
+
+            with open(part_filename, mode) as file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+
+        if expected_size and os.path.getsize(part_filename) < expected_size:
+            raise requests.ConnectionError(
+                f"Connection closed after {os.path.getsize(part_filename)} of {expected_size} bytes")
+
+        os.replace(part_filename, local_filename)
+        cached['complete'] = True
+        update_download_metadata(metadata_file, download_url, cached)
+        return True
+
+    return transport.call(urlparse(download_url).netloc, attempt_download)
+
+def build_report_link_index(page_html, page_url):
+    """
+    Build a dict of report date (YYMMDD) -> download URL for every
+    eps_nom_report file linked from the statistics page.
+    """
+    links = {}
+    for match in REPORT_HREF_PATTERN.finditer(page_html):
+        href, date_str = match.groups()
+        # Keep the first link for each date, same as the old page scan
+        links.setdefault(date_str, urljoin(page_url, html.unescape(href)))
+    return links
+
+def get_report_link_index(session, url, index_file=LINK_INDEX_FILE):
+    """
+    Get the report link index for the statistics page.
+    The index is cached locally with the page ETag/Last-Modified, so an
+    unchanged page costs a 304 and is not parsed again.
+    """
+    cached = load_json_cache(index_file)
+    headers = {}
+    if cached.get('url') == url:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    def fetch_page():
+        response = session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    print(f"Accessing webpage: {url}")
+    response = transport.call(urlparse(url).netloc, fetch_page)
+    if response.status_code == 304:
+        print(f"Statistics page not modified, using cached link index ({len(cached['links'])} reports)")
+        return cached['links']
+
+    links = build_report_link_index(response.text, url)
+    print(f"Indexed {len(links)} report links on statistics page")
+    save_json_cache({
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'links': links,
+    }, index_file)
+    return links
+
+def download_excel(url, local_filename, session=None, link_index=None):
     """
     Download Excel file from NHS website.
     """
     try:
-        print(f"Accessing webpage: {url}")
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
+        if session is None:
+            session = create_http_session()
+        if link_index is None:
+            link_index = get_report_link_index(session, url)
+
         # Adjust target filename to match NHS website format
         target_file = local_filename.replace('+', '-')
         print(f"Looking for file: {target_file}")
-        
-        download_url = None
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            if target_file.replace('.xlsx', '') in href:
-                download_url = href if href.startswith('http') else f"https://digital.nhs.uk{href}"
-                print(f"\nFound download URL: {download_url}")
-                break
-        
+
+        date_str = target_file.split('-')[-1].replace('.xlsx', '')  # Get YYMMDD part
+        download_url = link_index.get(date_str)
         if not download_url:
             print(f"\nCould not find download link for {target_file}")
             return False
-            
+        print(f"\nFound download URL: {download_url}")
+
         print(f"\nDownloading file from: {download_url}")
-        file_response = requests.get(download_url)
-        file_response.raise_for_status()
-        
-        with open(local_filename, 'wb') as file:
-            file.write(file_response.content)
+        if not download_file(session, download_url, local_filename):
+            return False
         print(f"Successfully downloaded {local_filename}")
         return True
         
-    except requests.RequestException as e:
+    except (requests.RequestException, CircuitOpenError) as e:
         print(f"Error downloading file: {e}")
         print(f"Attempted URL: {url}")
         return False
 
-def modify_excel(filename):
+def get_week_from_filename(filename):
+    """
+    Get the 'Week' value (YYYY-MM-DD) from the YYMMDD part of the filename.
+    """
+    date_str = filename.split('-')[-1].replace('.xlsx', '')  # Get YYMMDD part
+    file_date = datetime.strptime(date_str, '%y%m%d')
+    return file_date.strftime('%Y-%m-%d')
+
+def modify_excel(filename, quarantine=None):
     """
     Modify Excel file with required changes:
     - Select 'Dispenser Nominations' sheet
+    - Validate and type the populated rows (DispenserSchema); rows that fail
+      are removed and added to quarantine
     - Add 'Week' column with appropriate date
-    - Rename LPC column title (I1)
+    - Rename LPC column title, found by header (DispenserSchema)
     - Save only this sheet
     """
     try:
@@ -193,20 +618,45 @@ def modify_excel(filename):
         sheet = workbook['Dispenser Nominations']
         print(f"\nWorking with sheet: {sheet.title}")
         
-        # Find last populated row in column B
+        # Find columns by header rather than position
+        schema = DispenserSchema(next(sheet.iter_rows(max_row=1, values_only=True)))
+
+        # Find last populated row in the Dispenser Name column
         last_populated_row = 1  # Start at 1 to account for header
         for row in range(2, sheet.max_row + 1):
-            if sheet[f'B{row}'].value is not None:
+            if sheet.cell(row=row, column=schema.key_index + 1).value is not None:
                 last_populated_row = row
             else:
                 break  # Exit loop when we find first empty cell
         
-        print(f"Found last populated row in column B: {last_populated_row}")
+        print(f"Found last populated row in {DISPENSER_KEY_COLUMN} column: {last_populated_row}")
+
+        # Validate and type the populated rows, moving the rows that pass up over those that fail
+        if quarantine is None:
+            quarantine = Quarantine()
+        quarantine.header = schema.output_header()
+        next_row = 2
+        for row_number, cells in enumerate(sheet.iter_rows(min_row=2, max_row=last_populated_row), start=2):
+            values = [cell.value for cell in cells]
+            converted = list(values)
+            try:
+                schema.convert(converted)
+            except ValueError as e:
+                quarantine.add(row_number, str(e), values)
+                quarantine.check(row_number - 1)
+                continue
+            target = cells if next_row == row_number else sheet[next_row]
+            for cell, value in zip(target, converted):
+                if cell.value is not value:
+                    cell.value = value
+            next_row += 1
+        if quarantine:
+            sheet.delete_rows(next_row, last_populated_row - next_row + 1)
+            last_populated_row = next_row - 1
+            print(f"Quarantined {len(quarantine)} '{DISPENSER_SHEET}' rows that failed validation")
         
         # Extract date from filename
-        date_str = filename.split('-')[-1].replace('.xlsx', '')  # Get YYMMDD part
-        file_date = datetime.strptime(date_str, '%y%m%d')
-        formatted_date = file_date.strftime('%Y-%m-%d')
+        formatted_date = get_week_from_filename(filename)
         print(f"Using date: {formatted_date}")
         
         # Insert new column A
@@ -221,10 +671,11 @@ def modify_excel(filename):
         
         print(f"Added date {formatted_date} to rows 2 through {last_populated_row}")
 
-        # Rename LPC column (I1) after inserting new column
-        old_title = sheet['I1'].value
-        sheet['I1'] = 'Local Pharmaceutical Committee (LPC)'
-        print(f"Renamed column I1 from '{old_title}' to 'Local Pharmaceutical Committee (LPC)'")
+        # Rename LPC column, one to the right after inserting new column
+        lpc_cell = sheet.cell(row=1, column=schema.lpc_index + 2)
+        old_title = lpc_cell.value
+        lpc_cell.value = LPC_COLUMN_TITLE
+        print(f"Renamed column {lpc_cell.coordinate} from '{old_title}' to '{LPC_COLUMN_TITLE}'")
         
         return workbook
     except Exception as e:
@@ -265,132 +716,2188 @@ def excel_to_csv(workbook, csv_filename):
         traceback.print_exc()
         return False
 
-def upload_to_gcp(bucket_name, source_file_name, destination_blob_name):
+class SchemaError(ValueError):
+    """
+    Raised when the 'Dispenser Nominations' sheet no longer matches DISPENSER_SCHEMA.
+    """
+
+def convert_text(value):
+    """
+    Text column value: numbers and dates are kept as their text.
+    """
+    return value if value is None or isinstance(value, str) else str(value)
+
+def convert_code(value):
+    """
+    Required text value, such as the ODS code.
+    """
+    value = convert_text(value)
+    if value is None or not value.strip():
+        raise ValueError("missing")
+    return value
+
+def convert_count(value):
+    """
+    Nomination count: a whole number, not negative. Blank is allowed.
+    """
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError(f"{value!r} is not a nomination count")
+    return value
+
+# Type name -> (converter, type a value may already have to skip the converter)
+DISPENSER_CONVERTERS = {
+    'text': (convert_text, str),
+    'code': (convert_code, None),
+    'count': (convert_count, None),
+}
+# Type name -> Arrow type of the column in Parquet and BigQuery
+DISPENSER_ARROW_TYPES = {
+    'text': 'string',
+    'code': 'string',
+    'count': 'int64',
+}
+
+class DispenserSchema:
+    """
+    DISPENSER_SCHEMA compiled against the header row of one sheet. Each column
+    is found by its header once, so NHS moving or adding a column cannot shift
+    data into the wrong place; a missing required column raises SchemaError.
+    The Dispenser Name column that ends the data falls back to column B, where
+    it has always been, if no header matches.
+    convert() then validates and types a row, touching only the mapped columns.
+    """
+    def __init__(self, header):
+        self.header = list(header)
+        names = [' '.join(str(value).split()).lower() if value is not None else '' for value in self.header]
+        self.indexes = {}
+        for column, header_name, kind, required in DISPENSER_SCHEMA:
+            matches = ([index for index, name in enumerate(names) if name == header_name]
+                       or [index for index, name in enumerate(names) if name.startswith(header_name)])
+            if len(matches) == 1:
+                self.indexes[column] = matches[0]
+            elif required:
+                raise SchemaError(f"Expected one '{column}' column in the '{DISPENSER_SHEET}' header, "
+                                  f"found {len(matches)}: {self.header}")
+        if DISPENSER_KEY_COLUMN not in self.indexes:
+            if len(self.header) <= DISPENSER_KEY_DEFAULT_INDEX:
+                raise SchemaError(f"No '{DISPENSER_KEY_COLUMN}' column in the '{DISPENSER_SHEET}' header: {self.header}")
+            self.indexes[DISPENSER_KEY_COLUMN] = DISPENSER_KEY_DEFAULT_INDEX
+        self.key_index = self.indexes[DISPENSER_KEY_COLUMN]
+        self.lpc_index = self.indexes[LPC_COLUMN_TITLE]
+        self._converters = [
+            (column, self.indexes[column], *DISPENSER_CONVERTERS[kind])
+            for column, _, kind, _ in DISPENSER_SCHEMA if column in self.indexes
+        ]
+
+    def output_header(self):
+        """
+        The sheet header with the LPC column title renamed.
+        """
+        header = list(self.header)
+        header[self.lpc_index] = LPC_COLUMN_TITLE
+        return header
+
+    def arrow_types(self, offset=1):
+        """
+        Arrow types of the mapped columns, by position in a transformed row
+        ('Week' first as a date, then the sheet row from position offset).
+        """
+        types = {0: pa.date32()}
+        for column, _, kind, _ in DISPENSER_SCHEMA:
+            if column in self.indexes:
+                types[self.indexes[column] + offset] = getattr(pa, DISPENSER_ARROW_TYPES[kind])()
+        return types
+
+    def convert(self, row, offset=0):
+        """
+        Validate and type, in place, the mapped columns of a list holding a
+        sheet row from position offset. Raises ValueError naming the column.
+        """
+        width = len(row) - offset
+        for column, index, converter, converted_type in self._converters:
+            value = row[index + offset] if index < width else None
+            if value.__class__ is converted_type:
+                continue
+            try:
+                value = converter(value)
+            except ValueError as e:
+                raise ValueError(f"{column}: {e}")
+            if index < width:
+                row[index + offset] = value
+
+class Quarantine:
+    """
+    Rows that failed schema validation, kept aside with their sheet row
+    number and the reason so they can be checked and fixed by hand.
+    """
+    def __init__(self):
+        self.header = None
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, row_number, reason, row):
+        self.rows.append([row_number, reason, *row])
+
+    def check(self, data_rows):
+        """
+        Raise SchemaError if more than QUARANTINE_MAX_FRACTION of the data_rows
+        read so far have failed, as the sheet layout has then probably changed.
+        """
+        if len(self.rows) > QUARANTINE_MAX_FRACTION * max(data_rows, QUARANTINE_MIN_ROWS):
+            row_number, reason = self.rows[-1][:2]
+            raise SchemaError(f"{len(self.rows)} of the first {data_rows} '{DISPENSER_SHEET}' rows failed "
+                              f"validation (last: row {row_number}, {reason}), the sheet layout has probably changed")
+
+    def write_csv(self, csv_filename):
+        with open(csv_filename, 'w', encoding='utf-8', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow(['Row', 'Reason', *(self.header or [])])
+            csv_writer.writerows(self.rows)
+        print(f"Wrote {len(self.rows)} quarantined rows to {csv_filename}")
+
+def transform_dispenser_rows(rows, formatted_date, quarantine=None):
+    """
+    Apply the modify_excel changes to rows of the 'Dispenser Nominations'
+    sheet, with columns found by header through DispenserSchema:
+    - 'Week' date prepended to each row, down to the last populated Dispenser Name
+    - LPC column title renamed
+    - Rows in that range validated and typed in the same pass; rows that fail
+      are left out and added to quarantine
+    Raises SchemaError if the header does not match, or if more than
+    QUARANTINE_MAX_FRACTION of the rows fail.
+    Yields the header row first, then one list per sheet row.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise SchemaError(f"'{DISPENSER_SHEET}' sheet is empty")
+    schema = DispenserSchema(header)
+    if quarantine is None:
+        quarantine = Quarantine()
+    quarantine.header = schema.output_header()
+    yield ['Week', *quarantine.header]
+
+    week = datetime.strptime(formatted_date, '%Y-%m-%d').date()
+    key_index = schema.key_index
+    data_rows = 0
+    for row_number, row in enumerate(rows, start=2):
+        # Stop filling dates (and validating) at the first empty Dispenser Name
+        if week is not None and (len(row) <= key_index or row[key_index] is None):
+            week = None
+        if week is None:
+            yield [None, *row]
+            continue
+
+        data_rows += 1
+        converted = [week, *row]
+        try:
+            schema.convert(converted, offset=1)
+        except ValueError as e:
+            quarantine.add(row_number, str(e), row)
+            quarantine.check(data_rows)
+            continue
+        yield converted
+
+    if quarantine:
+        print(f"Quarantined {len(quarantine)} of {data_rows} '{DISPENSER_SHEET}' rows that failed validation")
+
+def iter_dispenser_rows(filename, reader='openpyxl', quarantine=None):
     """
-    Upload file to GCP bucket.
+    Stream the 'Dispenser Nominations' sheet with the same changes as
+    modify_excel, without loading the workbook in edit mode.
+    Rows that fail validation are added to quarantine.
+    Yields the header row first, then one list per sheet row.
     """
+    formatted_date = get_week_from_filename(filename)
+    with open_workbook_reader(filename, reader) as workbook:
+        if DISPENSER_SHEET not in workbook.sheet_names:
+            raise Exception(f"Could not find '{DISPENSER_SHEET}' sheet")
+        yield from transform_dispenser_rows(workbook.iter_rows(DISPENSER_SHEET), formatted_date, quarantine)
+
+def get_dispenser_arrow_types(header):
+    """
+    Arrow types from DISPENSER_SCHEMA for a transformed 'Dispenser Nominations'
+    header row ('Week' first), by column position.
+    """
+    return DispenserSchema(header[1:]).arrow_types()
+
+def write_dispenser_rows(rows, csv_filename=None, parquet_filename=None, modified_excel_filename=None,
+                         bigquery_writer=None):
+    """
+    Write transformed 'Dispenser Nominations' rows, the header first as
+    transform_dispenser_rows yields them, straight to CSV and/or Parquet.
+    If modified_excel_filename is given, the same rows are also written to a
+    write-only workbook, so the sheet is never held in memory twice.
+    If bigquery_writer is given, the rows are also staged for its load job.
+    Returns the number of data rows written.
+    """
+    csvfile = None
+    csv_writer = None
+    parquet_writer = None
+    modified_workbook = None
+    modified_sheet = None
+
+    header = next(rows)
+    if csv_filename:
+        csvfile = open(csv_filename, 'w', encoding='utf-8', newline='')
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(header)
+    if parquet_filename:
+        parquet_writer = ParquetRowWriter(parquet_filename, header, get_dispenser_arrow_types(header), key_index=0)
+    if modified_excel_filename:
+        modified_workbook = openpyxl.Workbook(write_only=True)
+        modified_sheet = modified_workbook.create_sheet(DISPENSER_SHEET)
+        modified_sheet.append(header)
+    if bigquery_writer is not None:
+        bigquery_writer.open(header, get_dispenser_arrow_types(header))
+
+    row_count = 0
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
+        for row in rows:
+            if csv_writer is not None:
+                csv_writer.writerow(row)
+            if parquet_writer is not None:
+                parquet_writer.write_row(row)
+            if modified_sheet is not None:
+                modified_sheet.append(row)
+            if bigquery_writer is not None:
+                bigquery_writer.write_row(row)
+            row_count += 1
+        if parquet_writer is not None:
+            parquet_writer.close()
+        if bigquery_writer is not None:
+            bigquery_writer.close()
+    finally:
+        if csvfile is not None:
+            csvfile.close()
 
-        blob.upload_from_filename(source_file_name)
-        print(f"File {source_file_name} uploaded to {destination_blob_name} in bucket {bucket_name}")
-        return True
+    if csv_filename:
+        print(f"Streamed '{DISPENSER_SHEET}' sheet to {csv_filename} ({row_count} rows)")
+    if parquet_writer is not None:
+        print(f"Streamed '{DISPENSER_SHEET}' sheet to {parquet_filename} ({parquet_writer.row_count} rows)")
+
+    if modified_workbook is not None and not save_excel(modified_workbook, modified_excel_filename):
+        raise Exception(f"Could not save {modified_excel_filename}")
+    return row_count
+
+def export_dispenser_rows(filename, csv_filename=None, parquet_filename=None, modified_excel_filename=None,
+                          reader='openpyxl', bigquery_writer=None, quarantine=None):
+    """
+    Transform the 'Dispenser Nominations' sheet and write it straight to
+    CSV and/or Parquet through write_dispenser_rows. Memory stays flat
+    regardless of sheet size.
+    Rows that fail validation are added to quarantine instead.
+    Returns the number of data rows written, or None on failure.
+    """
+    try:
+        return write_dispenser_rows(iter_dispenser_rows(filename, reader, quarantine), csv_filename=csv_filename,
+                                    parquet_filename=parquet_filename,
+                                    modified_excel_filename=modified_excel_filename, bigquery_writer=bigquery_writer)
     except Exception as e:
-        print(f"Error uploading to GCP: {e}")
-        return False
-    
-def setup_working_directory():
+        print(f"Error streaming Excel to CSV/Parquet: {e}")
+        print(f"Exception type: {type(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def add_week_column(rows, formatted_date):
     """
-    Create and use a specific directory for working files.
+    Prepend a 'Week' column to the header and every row of a sheet.
     """
-    # Create directory in user's home directory
-    work_dir = os.path.expanduser("~/eps_nominations_processing")
-    if not os.path.exists(work_dir):
-        os.makedirs(work_dir)
-    
-    # Change to this directory
-    os.chdir(work_dir)
-    print(f"\nWorking directory: {os.getcwd()}")
-    return work_dir
+    for row_number, row in enumerate(rows, start=1):
+        yield ['Week' if row_number == 1 else formatted_date, *row]
 
-    
-def cleanup_files(files_to_remove):
+EXTRACT_TRANSFORMS = {
+    'raw': lambda rows, formatted_date: (list(row) for row in rows),
+    'week': add_week_column,
+    'dispenser': transform_dispenser_rows,
+}
+
+def load_extract_config(config_filename):
     """
-    Safely remove local files if they exist.
+    Load a sheet extraction config, e.g.
+        {"sheets": [{"sheet": "GP Nominations", "transform": "week", "skip_rows": 2,
+                     "stop_at_blank": true, "blob": "sources/.../eps_nom_gp+{yymmdd}.csv"}]}
+    transform is one of EXTRACT_TRANSFORMS (default 'raw'), skip_rows drops title
+    rows above the header and stop_at_blank ends the sheet at the first empty row.
+    The blob may use {yymmdd} and {week}, and its extension (.csv or .parquet)
+    picks the output format.
+    Returns the list of sheet configs with defaults filled in.
     """
-    for file in files_to_remove:
-        if os.path.exists(file):
-            try:
-                os.remove(file)
-                print(f"Removed {file}")
-            except Exception as e:
-                print(f"Error removing {file}: {e}")
+    with open(config_filename, encoding='utf-8') as file:
+        config = json.load(file)
+
+    sheets = []
+    for sheet in config.get('sheets', []):
+        sheet = {'transform': 'raw', 'skip_rows': 0, 'stop_at_blank': False, **sheet}
+        if not sheet.get('sheet') or not sheet.get('blob'):
+            raise ValueError(f"Sheet extracts need a 'sheet' and a 'blob': {sheet}")
+        if sheet['transform'] not in EXTRACT_TRANSFORMS:
+            raise ValueError(f"Unknown transform '{sheet['transform']}' for sheet '{sheet['sheet']}', "
+                             f"expected one of {', '.join(EXTRACT_TRANSFORMS)}")
+        if not sheet['blob'].endswith(('.csv', '.parquet')):
+            raise ValueError(f"Blob for sheet '{sheet['sheet']}' must end in .csv or .parquet")
+        sheets.append(sheet)
+    if not sheets:
+        raise ValueError(f"No sheets configured in {config_filename}")
+    return sheets
+
+def extract_sheet(workbook, sheet, output_filename, formatted_date):
+    """
+    Stream one configured sheet from an open workbook reader through its
+    transform into a CSV or Parquet file. Returns the number of data rows.
+    """
+    rows = islice(workbook.iter_rows(sheet['sheet']), sheet['skip_rows'], None)
+    if sheet['stop_at_blank']:
+        rows = takewhile(lambda row: any(value is not None for value in row), rows)
+    rows = EXTRACT_TRANSFORMS[sheet['transform']](rows, formatted_date)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError(f"Sheet '{sheet['sheet']}' has no rows")
+
+    row_count = 0
+    if output_filename.endswith('.parquet'):
+        if sheet['transform'] == 'dispenser':
+            parquet_writer = ParquetRowWriter(output_filename, header, get_dispenser_arrow_types(header), key_index=0)
         else:
-            print(f"File not found, skipping: {file}")
+            parquet_writer = ParquetRowWriter(output_filename, header)
+        for row in rows:
+            parquet_writer.write_row(row)
+            row_count += 1
+        parquet_writer.close()
+    else:
+        with open(output_filename, 'w', encoding='utf-8', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow(header)
+            for row in rows:
+                csv_writer.writerow(row)
+                row_count += 1
+    print(f"Extracted '{sheet['sheet']}' sheet to {output_filename} ({row_count} rows)")
+    return row_count
 
-def main():
+def extract_sheets(filename, sheets, output_filenames, reader='xml', dispenser_outputs=None, quarantine=None):
     """
-    Main function with GCP bucket checking.
+    Extract every configured sheet in one pass over the workbook: it is opened
+    once, so the shared strings and styles are parsed once and each sheet is
+    read once. The xml reader streams the sheets in parallel threads, other
+    backends one after another.
+    If dispenser_outputs (write_dispenser_rows keyword arguments) is given,
+    the pipeline's own 'Dispenser Nominations' output is written in the same
+    pass, rows that fail validation being added to quarantine.
+    Returns (Dispenser Nominations row count or None, {sheet name: row count}),
+    or None on failure.
     """
-    # Set up working directory first
-    # work_dir = setup_working_directory()
-    # print(f"Files will be processed in: {work_dir}")
-    
-    # Set up working directory first
-    work_dir = setup_working_directory()
-    print(f"Files will be processed in: {work_dir}")
+    try:
+        formatted_date = get_week_from_filename(filename)
+        with open_workbook_reader(filename, reader) as workbook:
+            sheet_names = [sheet['sheet'] for sheet in sheets] + ([DISPENSER_SHEET] if dispenser_outputs else [])
+            missing = [sheet_name for sheet_name in sheet_names if sheet_name not in workbook.sheet_names]
+            if missing:
+                raise Exception(f"Could not find sheets: {', '.join(missing)}")
 
-    # Set up auth
-    if not authentication():
-        print("Authentication failed. Exiting.")
-        return 
-   
-    # Config
-    base_url = "https://digital.nhs.uk/services/electronic-prescription-service/statistics"
-    base_filename = "eps_nom_report+"  # Note the + here
-    gcp_bucket_name = "phlo-sandpit-raw-data-lake"
-    blob_prefix = "sources/reference-data/nhs-eps-noms/"
-
-    # Check latest file in GCP
-    latest_processed_date = get_latest_processed_date(gcp_bucket_name, blob_prefix)
-    
-    # Get the latest report date
-    report_date = get_latest_report_date()
+            max_workers = len(sheet_names) if isinstance(workbook, XmlReader) else 1
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                dispenser_future = None
+                if dispenser_outputs:
+                    rows = transform_dispenser_rows(workbook.iter_rows(DISPENSER_SHEET), formatted_date, quarantine)
+                    dispenser_future = executor.submit(write_dispenser_rows, rows, **dispenser_outputs)
+                futures = {
+                    sheet['sheet']: executor.submit(extract_sheet, workbook, sheet, output_filename, formatted_date)
+                    for sheet, output_filename in zip(sheets, output_filenames)
+                }
+                return (dispenser_future and dispenser_future.result(),
+                        {sheet_name: future.result() for sheet_name, future in futures.items()})
+    except Exception as e:
+        print(f"Error extracting sheets: {e}")
+        print(f"Exception type: {type(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
 
-    # Print dates for debugging
-    print(f"Latest processed date: {latest_processed_date}")
-    print(f"Current report date: {report_date}")
-    
-    # Skip if file exists
-    if latest_processed_date and report_date <= latest_processed_date:
-        print("Already have the latest file processed. Skipping download.")
-        return
-    
-    # Generate filenames - Note we use - for download but + for GCP
-    source_filename = generate_filename(base_filename, report_date)  # Will have - for download
-    gcp_filename = source_filename.replace('-', '+')  # Convert to + for GCP storage
-    
-    excel_url = base_url
-    
-    local_excel_filename = source_filename
-    modified_excel_filename = f"modified_{source_filename}"
-    local_csv_filename = gcp_filename.replace('.xlsx', '.csv')  # Use + version for CSV
-     # Remove 'processed_' prefix from GCP blob name
-    gcp_csv_blob_name = f"{blob_prefix}{gcp_filename[:-5]}.csv"  # Use + version for GCP
+class ColumnBuilder:
+    """
+    One column of a ColumnarRows store. Whole numbers and floats go into
+    typed arrays, repeated strings are dictionary encoded (each distinct value
+    kept once, rows hold an int32 code) and anything else, a mix of kinds or
+    mostly distinct strings (names, addresses) fall back to a list of objects.
+    """
+    def __init__(self):
+        self.kind = 'empty'
+        self.nulls = bytearray()
+        self.values = None
+        self.dictionary = None
 
-    # Check if file exists
-    if check_file_exists(gcp_bucket_name, gcp_csv_blob_name):
-        print(f"File {gcp_csv_blob_name} already exists in GCP. Skipping processing.")
-        return
+    @staticmethod
+    def _kind_of(value):
+        if isinstance(value, bool):
+            return 'object'
+        if isinstance(value, int):
+            return 'int'
+        if isinstance(value, float):
+            return 'float'
+        if isinstance(value, str):
+            return 'string'
+        return 'object'
 
-    # Download and process the file
-    if download_excel(excel_url, local_excel_filename):
-        modified_workbook = modify_excel(local_excel_filename)
-        if modified_workbook is not None:
-            if save_excel(modified_workbook, modified_excel_filename):
-                if excel_to_csv(modified_workbook, local_csv_filename):
-                    if upload_to_gcp(gcp_bucket_name, local_csv_filename, gcp_csv_blob_name):
-                        print("Process successfully complete")
-                    else:
-                        print("Failed to upload CSV to GCP. Exiting Process.")
-                else:
-                    print("Failed to convert xlsx to CSV. Exiting Process.")
+    def _python_values(self):
+        if self.kind == 'empty':
+            return [None] * len(self.nulls)
+        if self.kind == 'string':
+            strings = list(self.dictionary)
+            return [strings[code] if code >= 0 else None for code in self.values]
+        return [None if null else value for value, null in zip(self.values, self.nulls)]
+
+    def _widen(self, kind):
+        if self.kind == 'empty':
+            self.kind = kind
+            if kind == 'int':
+                self.values = array('q', bytes(8 * len(self.nulls)))
+            elif kind == 'float':
+                self.values = array('d', [float('nan')] * len(self.nulls))
+            elif kind == 'string':
+                self.values = array('i', [-1] * len(self.nulls))
+                self.dictionary = {}
             else:
-                print("Failed to save modified Excel file. Exiting Process.")
+                self.values = [None] * len(self.nulls)
         else:
-            print("Failed to modify Excel file. Exiting Process.")
-    else:
-        print("Failed to download Excel file. Exiting.")
+            # Mixed ints and floats stay objects too, so they print as they did in the sheet
+            self.values = self._python_values()
+            self.kind = 'object'
+            self.dictionary = None
+
+    def append(self, value):
+        if value is not None:
+            kind = self._kind_of(value)
+            if kind != self.kind and self.kind != 'object':
+                self._widen(kind)
+        if self.kind == 'empty':
+            pass
+        elif self.kind == 'int':
+            try:
+                self.values.append(0 if value is None else value)
+            except OverflowError:
+                self._widen('object')
+                self.values.append(value)
+        elif self.kind == 'float':
+            self.values.append(float('nan') if value is None else value)
+        elif self.kind == 'string':
+            self.values.append(-1 if value is None else self.dictionary.setdefault(value, len(self.dictionary)))
+        else:
+            self.values.append(value)
+        self.nulls.append(value is None)
+
+        if (self.kind == 'string' and len(self.nulls) % DICTIONARY_CHECK_INTERVAL == 0
+                and len(self.dictionary) > len(self.nulls) * DICTIONARY_MAX_RATIO):
+            self._widen('object')
 
+    def to_series(self, name):
+        if self.kind == 'int':
+            mask = np.frombuffer(self.nulls, dtype=bool)
+            return pd.Series(pd.arrays.IntegerArray(np.frombuffer(self.values, dtype=np.int64), mask), name=name)
+        if self.kind == 'float':
+            return pd.Series(np.frombuffer(self.values, dtype=np.float64), name=name)
+        if self.kind == 'string':
+            codes = np.frombuffer(self.values, dtype=np.int32)
+            return pd.Series(pd.Categorical.from_codes(codes, categories=list(self.dictionary)), name=name)
+        return pd.Series(self._python_values() if self.kind == 'empty' else self.values, dtype=object, name=name)
+
+class ColumnarRows:
     """
-    # Clean up
-    cleanup_files([
-        local_excel_filename,
-        modified_excel_filename,
-        local_csv_filename
-    ])
+    Compact in-memory store for sheet rows, filled one row at a time, instead
+    of a list of tuples of boxed values. Each column is a ColumnBuilder and
+    'Week' is kept as a single scalar plus the number of rows it covers.
     """
+    def __init__(self, width, week=None):
+        self.width = width
+        self.week = week
+        self.week_rows = 0
+        self.row_count = 0
+        self.columns = [ColumnBuilder() for _ in range(width)]
+
+    def append(self, row):
+        if len(row) > self.width:
+            raise ValueError(f"Row {self.row_count + 1} has {len(row)} values, expected at most {self.width}")
+        for column, value in zip_longest(self.columns, row):
+            column.append(value)
+        self.row_count += 1
+
+    def fill_week_until_null(self, column_index):
+        """
+        Apply 'Week' down to the row before the first empty cell in the given column.
+        """
+        first_null = self.columns[column_index].nulls.find(1)
+        self.week_rows = self.row_count if first_null == -1 else first_null
+
+    def to_frame(self, column_names):
+        """
+        Build a DataFrame straight from the typed columns. column_names
+        includes 'Week' first if the store has a week.
+        """
+        series = []
+        names = iter(column_names)
+        if self.week is not None:
+            week_values = np.full(self.row_count, np.datetime64('NaT'), dtype='datetime64[ns]')
+            week_values[:self.week_rows] = np.datetime64(pd.Timestamp(self.week))
+            series.append(pd.Series(week_values, name=next(names)))
+        for column, name in zip(self.columns, names):
+            series.append(column.to_series(name))
+        return pd.concat(series, axis=1)
+
+def coerce_frame_types(frame):
+    """
+    Give each column of the sheet frame a proper type, one column at a time.
+    """
+    for name in frame.columns[1:]:
+        column = frame[name]
+        kind = pd.api.types.infer_dtype(column, skipna=True)
+        if kind == 'floating' and column.dropna().mod(1).eq(0).all():
+            # Whole numbers read alongside blanks come back as floats
+            frame[name] = column.astype('Int64')
+        elif kind == 'integer':
+            frame[name] = column.astype('Int64')
+        elif kind == 'boolean':
+            frame[name] = column.astype('boolean')
+        elif kind in ('datetime', 'datetime64'):
+            frame[name] = pd.to_datetime(column)
+    return frame
+
+def mixed_columns_as_text(frame):
+    """
+    Columns of the sheet frame still holding a mix of kinds, as text, for
+    outputs that need one type per column. The frame keeps the sheet's values.
+    """
+    frame = frame.copy()
+    for name in frame.columns[1:]:
+        column = frame[name]
+        if column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) not in (
+                'integer', 'floating', 'boolean', 'string', 'date', 'datetime', 'empty'):
+            frame[name] = column.where(column.isna(), column.astype(str))
+    return frame
+
+def check_count_column(column):
+    """
+    convert_count for a whole frame column. Returns the values as float
+    numbers and a mask of the ones that are not a nomination count.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+    numeric = column
+    if column.dtype == object:
+        # Text only counts as its digits, and True/False not at all
+        types = column.map(type)
+        is_text = types.eq(str)
+        digits = column.where(is_text).str.strip().str.isdigit().astype('boolean').fillna(False)
+        numeric = column.where(~(is_text & ~digits) & ~types.eq(bool))
+    numbers = pd.to_numeric(numeric, errors='coerce')
+    failed = column.notna() & (numbers.isna() | numbers.mod(1).ne(0) | numbers.lt(0))
+    return numbers, failed.to_numpy(dtype=bool)
+
+def validate_dispenser_frame(frame, schema, data_rows, quarantine):
+    """
+    DispenserSchema.convert for the first data_rows rows of the sheet frame
+    ('Week' first), one column at a time: codes must not be blank and counts
+    must be whole and not negative. Rows that fail are dropped and added to
+    quarantine, in sheet order and with the reason convert gives, so the
+    QUARANTINE_MAX_FRACTION check trips on the same row as the stream engine.
+    Returns the frame without them, counts as whole numbers and the other
+    mapped columns as text.
+    """
+    in_data = np.arange(len(frame)) < data_rows
+    reasons = np.full(len(frame), None, dtype=object)
+    # Only a row's first failing column gives its reason, as in convert
+    passed = np.ones(len(frame), dtype=bool)
+    counts = []
+    texts = []
+    for column, _, kind, _ in DISPENSER_SCHEMA:
+        if column not in schema.indexes:
+            continue
+        name = frame.columns[schema.indexes[column] + 1]
+        values = frame[name]
+        if kind != 'count' and not isinstance(values.dtype, pd.CategoricalDtype) and (
+                pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty')):
+            texts.append(name)
+        if kind == 'text':
+            continue
+        if kind == 'code':
+            failed = (values.isna() | values.astype(str).str.strip().eq('')).to_numpy(dtype=bool)
+            failed &= in_data & passed
+            reasons[failed] = f"{column}: missing"
+            passed &= ~failed
+            continue
+
+        numbers, failed = check_count_column(values)
+        failed &= in_data & passed
+        passed &= ~failed
+        for position, value in zip(np.flatnonzero(failed), values[failed].tolist()):
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            reasons[position] = f"{column}: {value!r} is not a nomination count"
+        if not pd.api.types.is_integer_dtype(values.dtype):
+            counts.append((name, numbers))
+
+    # Counts read as floats or text become whole numbers and numbers in text columns text,
+    # quarantined rows keep what the sheet had
+    valid = in_data & passed
+    for name, numbers in counts:
+        frame[name] = frame[name].astype(object).where(~valid, numbers.where(valid).astype('Int64').astype(object))
+    for name in texts:
+        values = frame[name].astype(object)
+        frame[name] = values.where(~valid | values.isna(), values.astype(str))
+
+    failing = np.flatnonzero(~passed)
+    if len(failing):
+        rows = frame.iloc[failing, 1:].astype(object)
+        rows = rows.where(rows.notna(), None).values.tolist()
+        for position, row in zip(failing.tolist(), rows):
+            quarantine.add(position + 2, reasons[position], row)
+            quarantine.check(position + 1)
+        frame = frame.drop(index=frame.index[failing]).reset_index(drop=True)
+        print(f"Quarantined {len(quarantine)} of {data_rows} '{DISPENSER_SHEET}' rows that failed validation")
+    return frame
+
+def load_dispenser_frame(filename, reader='openpyxl', quarantine=None):
+    """
+    Load the 'Dispenser Nominations' sheet into a DataFrame once, via a
+    ColumnarRows store rather than a list of row tuples, and apply the
+    modify_excel changes as column operations:
+    - 'Week' column inserted, filled down to the last populated Dispenser Name
+    - Rows in that range validated by validate_dispenser_frame; rows that
+      fail are dropped and added to quarantine
+    - LPC column title renamed, columns being found by header (DispenserSchema)
+    - Column types coerced (whole numbers to Int64, 'Week' to a date)
+    Returns (frame, csv_header), csv_header being the header row as the CSV
+    should show it.
+    """
+    formatted_date = get_week_from_filename(filename)
+    with open_workbook_reader(filename, reader) as workbook:
+        if DISPENSER_SHEET not in workbook.sheet_names:
+            raise Exception(f"Could not find '{DISPENSER_SHEET}' sheet")
+        rows = workbook.iter_rows(DISPENSER_SHEET)
+        header = next(rows, None)
+        if header is None:
+            raise SchemaError(f"'{DISPENSER_SHEET}' sheet is empty")
+        schema = DispenserSchema(header)
+        columns = ColumnarRows(len(schema.header), week=formatted_date)
+        for row in rows:
+            columns.append(row)
+
+    if quarantine is None:
+        quarantine = Quarantine()
+    quarantine.header = schema.output_header()
+    csv_header = ['Week', *quarantine.header]
+
+    # Week is only filled down to the first empty Dispenser Name
+    columns.fill_week_until_null(schema.key_index)
+    frame = columns.to_frame(get_column_names(csv_header))
+    frame = validate_dispenser_frame(frame, schema, columns.week_rows, quarantine)
+    return coerce_frame_types(frame), csv_header
+
+def write_frame_outputs(frame, csv_header, csv_filename=None, parquet_filename=None, modified_excel_filename=None):
+    """
+    Write the transformed sheet frame to CSV and/or Parquet, and to a
+    write-only workbook like the stream engine if modified_excel_filename is given.
+    """
+    try:
+        if csv_filename:
+            frame.to_csv(csv_filename, index=False, header=[value if value is not None else '' for value in csv_header],
+                         date_format='%Y-%m-%d', lineterminator='\r\n', encoding='utf-8')
+            print(f"Exported '{DISPENSER_SHEET}' frame to CSV: {csv_filename} ({len(frame)} rows)")
+        if parquet_filename:
+            # Only rows with a Week, the notes below the data would otherwise change the column types
+            table = pa.Table.from_pandas(mixed_columns_as_text(frame[frame['Week'].notna()]), preserve_index=False)
+            types = get_dispenser_arrow_types(csv_header)
+            schema = pa.schema([
+                pa.field(field.name, types.get(position)
+                         or (pa.string() if field.type == pa.null() or pa.types.is_dictionary(field.type)
+                             else field.type))
+                for position, field in enumerate(table.schema)
+            ])
+            table = table.cast(schema)
+            pq.write_table(table, parquet_filename, compression=PARQUET_COMPRESSION,
+                           use_dictionary=get_dictionary_columns(schema) or False)
+            print(f"Exported '{DISPENSER_SHEET}' frame to Parquet: {parquet_filename} ({table.num_rows} rows)")
+        if modified_excel_filename:
+            modified_workbook = openpyxl.Workbook(write_only=True)
+            modified_sheet = modified_workbook.create_sheet(DISPENSER_SHEET)
+            modified_sheet.append(csv_header)
+            # Plain Python values, the week as a date and blanks as empty cells
+            values = frame.assign(Week=frame['Week'].dt.date).astype(object)
+            for row in values.where(values.notna(), None).itertuples(index=False, name=None):
+                modified_sheet.append(row)
+            if not save_excel(modified_workbook, modified_excel_filename):
+                return False
+        return True
+    except Exception as e:
+        print(f"Error writing frame outputs: {e}")
+        print(f"Exception type: {type(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def excel_to_parquet(workbook, parquet_filename):
+    """
+    Convert the modified 'Dispenser Nominations' sheet to Parquet.
+    """
+    try:
+        rows = workbook[DISPENSER_SHEET].iter_rows(values_only=True)
+        header = next(rows)
+        parquet_writer = ParquetRowWriter(parquet_filename, header, get_dispenser_arrow_types(header), key_index=0)
+        for row in rows:
+            parquet_writer.write_row(row)
+        parquet_writer.close()
+        print(f"Exported '{DISPENSER_SHEET}' sheet to Parquet: {parquet_filename}")
+        return True
+    except Exception as e:
+        print(f"Error converting Excel to Parquet: {e}")
+        print(f"Exception type: {type(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def stream_dispenser_rows_to_gcs(filename, storage_context, csv_blob_name=None, parquet_blob_name=None,
+                                 reader='openpyxl', compress=False, chunk_size=UPLOAD_CHUNK_SIZE, bigquery_writer=None,
+                                 quarantine=None):
+    """
+    Transform the 'Dispenser Nominations' sheet and upload it as CSV and/or
+    Parquet without an intermediate local file.
+    A reader thread parses the sheet into a bounded queue of row batches while
+    this thread encodes them into resumable uploads, so parsing and uploading
+    overlap and memory stays bounded by the queue size.
+    If bigquery_writer is given, the rows are also staged for its load job.
+    Rows that fail validation are added to quarantine instead.
+    Returns {'rows', 'bytes_out', 'csv_sha256', 'parquet_sha256'} or None on failure.
+    """
+    batches = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            batch = []
+            for row in iter_dispenser_rows(filename, reader, quarantine):
+                batch.append(row)
+                if len(batch) >= PIPELINE_BATCH_SIZE:
+                    put(batch)
+                    batch = []
+                    if stop.is_set():
+                        return
+            if batch:
+                put(batch)
+            put(None)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, name='dispenser-row-reader', daemon=True)
+    producer.start()
+
+    uploads = []
+    try:
+        csv_upload = parquet_upload = parquet_sink = parquet_writer = None
+        if csv_blob_name:
+            csv_upload = UploadStream(storage_context, csv_blob_name, compress=compress, chunk_size=chunk_size)
+            uploads.append(csv_upload)
+        if parquet_blob_name:
+            parquet_upload = UploadStream(storage_context, parquet_blob_name,
+                                          content_type='application/vnd.apache.parquet', chunk_size=chunk_size)
+            uploads.append(parquet_upload)
+            parquet_sink = pa.PythonFile(parquet_upload, mode='w')
+
+        buffer = io.StringIO()
+        csv_writer = csv.writer(buffer)
+        header = None
+        row_count = 0
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            if header is None:
+                header, batch = batch[0], batch[1:]
+                csv_writer.writerow(header)
+                if parquet_sink is not None:
+                    parquet_writer = ParquetRowWriter(parquet_sink, header, get_dispenser_arrow_types(header),
+                                                      key_index=0)
+                if bigquery_writer is not None:
+                    bigquery_writer.open(header, get_dispenser_arrow_types(header))
+            if csv_upload is not None:
+                csv_writer.writerows(batch)
+                csv_upload.write(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+            if parquet_writer is not None:
+                for row in batch:
+                    parquet_writer.write_row(row)
+            if bigquery_writer is not None:
+                for row in batch:
+                    bigquery_writer.write_row(row)
+            row_count += len(batch)
+        if header is None:
+            raise ValueError(f"No rows read from '{DISPENSER_SHEET}' sheet")
+
+        if bigquery_writer is not None:
+            bigquery_writer.close()
+        # Finalise only once every row is written, so an error above leaves nothing in the bucket
+        if parquet_writer is not None:
+            parquet_writer.close()
+            parquet_sink.close()
+        if csv_upload is not None:
+            csv_upload.close()
+
+        for upload in uploads:
+            print(f"Streamed '{DISPENSER_SHEET}' sheet to {upload.blob_name} in bucket "
+                  f"{storage_context.bucket_name} ({row_count} rows)")
+        return {
+            'rows': row_count,
+            'bytes_out': sum(upload.bytes_written for upload in uploads),
+            'csv_sha256': csv_upload.hexdigest() if csv_upload is not None else None,
+            'parquet_sha256': parquet_upload.hexdigest() if parquet_upload is not None else None,
+        }
+    except Exception as e:
+        for upload in uploads:
+            upload.abort()
+        print(f"Error streaming Excel to GCP: {e}")
+        print(f"Exception type: {type(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
+    finally:
+        stop.set()
+        producer.join()
+
+def get_delta_base(manifest, report_date):
+    """
+    Latest week before report_date with a CSV snapshot in the manifest,
+    as (base_date, entry), or None.
+    """
+    candidates = [
+        processed_date for processed_date in get_manifest_dates(manifest)
+        if processed_date.date() < report_date.date()
+        and manifest['weeks'][processed_date.strftime('%Y-%m-%d')].get('blob', '').endswith('.csv')
+    ]
+    if not candidates:
+        return None
+    base_date = max(candidates)
+    return base_date, manifest['weeks'][base_date.strftime('%Y-%m-%d')]
+
+def fetch_snapshot_csv(storage_context, snapshot_date, snapshot_entry):
+    """
+    Get the CSV snapshot of a processed week, reusing the local copy if its
+    sha256 still matches the manifest. Otherwise it is downloaded from the
+    bucket to a temporary file of its own, never over the week's working CSV.
+    Returns (local filename, whether it is a temporary file for the caller to
+    remove), or None on failure.
+    """
+    local_filename = generate_filename(BASE_FILENAME, snapshot_date).replace('-', '+').replace('.xlsx', '.csv')
+    if os.path.exists(local_filename) and file_sha256(local_filename) == snapshot_entry.get('sha256'):
+        return local_filename, False
+    descriptor, temp_filename = tempfile.mkstemp(prefix=f"{local_filename[:-4]}.", suffix='.snapshot.csv', dir='.')
+    os.close(descriptor)
+    try:
+        # Gzip encoded blobs are decompressed on download
+        transport.call(GCS_HOST, storage_context.blob(snapshot_entry['blob']).download_to_filename, temp_filename,
+                       timeout=GCS_TIMEOUT, retry=None)
+        print(f"Downloaded {snapshot_entry['blob']} to {temp_filename}")
+        return temp_filename, True
+    except Exception as e:
+        print(f"Error downloading snapshot {snapshot_entry['blob']}: {e}")
+        cleanup_files([temp_filename])
+        return None
+
+def get_delta_key_index(header):
+    """
+    Index of the ODS code column the delta is keyed on, found by header as
+    DispenserSchema finds it ('Week' first if the snapshot has it).
+    """
+    offset = 1 if header and header[0] == 'Week' else 0
+    indexes = DispenserSchema(header[offset:]).indexes
+    if DELTA_KEY_COLUMN not in indexes:
+        raise ValueError(f"No '{DELTA_KEY_COLUMN}' column to key the delta on")
+    return indexes[DELTA_KEY_COLUMN] + offset
+
+def iter_snapshot_rows(rows, header):
+    """
+    Yield (ODS code, row) for the data rows of a CSV snapshot. Blank rows and
+    the footnotes below the data, which have no code or no 'Week', are skipped.
+    """
+    key_index = get_delta_key_index(header)
+    has_week = bool(header) and header[0] == 'Week'
+    for row in rows:
+        if len(row) <= key_index or not row[key_index] or (has_week and not row[0]):
+            continue
+        yield row[key_index], row
+
+def load_snapshot_rows(csv_filename):
+    """
+    Read the data rows of a CSV snapshot into {ODS code: row}.
+    """
+    with open(csv_filename, encoding='utf-8', newline='') as csvfile:
+        rows = csv.reader(csvfile)
+        header = next(rows)
+        return header, dict(iter_snapshot_rows(rows, header))
+
+def export_delta(previous_csv_filename, current_csv_filename, delta_csv_filename):
+    """
+    Compare two weekly CSV snapshots keyed on ODS code and write only the
+    inserted, changed and removed rows, with a leading 'Change' column.
+    Removed rows keep the previous week's values. 'Week' is ignored when comparing.
+    Returns {'insert': n, 'update': n, 'delete': n}, or None on failure.
+    """
+    try:
+        previous_header, previous_rows = load_snapshot_rows(previous_csv_filename)
+        counts = {'insert': 0, 'update': 0, 'delete': 0}
+        with open(current_csv_filename, encoding='utf-8', newline='') as current_file, \
+                open(delta_csv_filename, 'w', encoding='utf-8', newline='') as delta_file:
+            current_rows = csv.reader(current_file)
+            header = next(current_rows)
+            if header != previous_header:
+                print(f"Columns changed since the previous week: {previous_header} -> {header}")
+            compare_from = 1 if header and header[0] == 'Week' else 0
+
+            delta_writer = csv.writer(delta_file)
+            delta_writer.writerow([DELTA_CHANGE_COLUMN] + header)
+            for key, row in iter_snapshot_rows(current_rows, header):
+                previous_row = previous_rows.pop(key, None)
+                if previous_row is None:
+                    change = 'insert'
+                elif previous_row[compare_from:] != row[compare_from:]:
+                    change = 'update'
+                else:
+                    continue
+                delta_writer.writerow([change] + row)
+                counts[change] += 1
+            for previous_row in previous_rows.values():
+                delta_writer.writerow(['delete'] + previous_row)
+                counts['delete'] += 1
+
+        print(f"Wrote delta {delta_csv_filename}: {counts['insert']} inserted, {counts['update']} changed, "
+              f"{counts['delete']} removed")
+        return counts
+    except Exception as e:
+        print(f"Error building delta: {e}")
+        return None
+
+def setup_working_directory():
+    """
+    Create and use a specific directory for working files.
+    """
+    # Create directory in user's home directory
+    work_dir = os.path.expanduser("~/eps_nominations_processing")
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    
+    # Change to this directory
+    os.chdir(work_dir)
+    print(f"\nWorking directory: {os.getcwd()}")
+    return work_dir
+
+    
+def cleanup_files(files_to_remove):
+    """
+    Safely remove local files if they exist.
+    """
+    for file in files_to_remove:
+        if os.path.exists(file):
+            try:
+                os.remove(file)
+                print(f"Removed {file}")
+            except Exception as e:
+                print(f"Error removing {file}: {e}")
+        else:
+            print(f"File not found, skipping: {file}")
+
+def reset_peak_rss():
+    """
+    Reset this process's RSS high-water mark (VmHWM), so the next
+    read_peak_rss covers only what follows. Returns False where it cannot be
+    reset (not Linux, or /proc/self/clear_refs not writable).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+def read_peak_rss():
+    """
+    Peak RSS in bytes since the last reset_peak_rss, or None if unknown.
+    """
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class RunMetrics:
+    """
+    Per-stage duration, bytes in/out, row counts, network retries and peak
+    memory for a run. Each stage is logged as a JSON line when it finishes,
+    and the run can be written out in Prometheus textfile format.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.started_at = time.time()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, week=None):
+        """
+        Time a stage. The yielded dict takes bytes_in, bytes_out, rows and ok.
+        peak_rss_bytes is the peak RSS during the stage: the high-water mark is
+        reset when it starts where Linux allows, so with stages running in
+        several threads it covers the time since the latest of them started.
+        Elsewhere it is only known if the stage raised the process peak
+        (ru_maxrss), and is None otherwise.
+        """
+        record = {'stage': name, 'week': week, 'bytes_in': None, 'bytes_out': None, 'rows': None, 'ok': True}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        peak_rss_reset = reset_peak_rss()
+        max_rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Stages run in one thread, so the thread's retry count is the stage's
+        retries_before = transport.thread_retries()
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record['ok'] = False
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 6)
+            record['retries'] = transport.thread_retries() - retries_before
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if peak_rss_reset:
+                record['peak_rss_bytes'] = read_peak_rss()
+            else:
+                # ru_maxrss is in KiB on Linux and bytes on macOS
+                record['peak_rss_bytes'] = ((max_rss if sys.platform == 'darwin' else max_rss * 1024)
+                                            if max_rss > max_rss_before else None)
+            if self.trace_memory:
+                record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            with self._lock:
+                self.stages.append(record)
+            print(json.dumps({'event': 'stage', **record}))
+
+    def emit_summary(self):
+        """
+        Log the whole run as one JSON line.
+        """
+        print(json.dumps({
+            'event': 'run',
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'seconds': round(time.time() - self.started_at, 6),
+            'ok': all(record['ok'] for record in self.stages),
+            'stages': len(self.stages),
+            'retries': sum(record['retries'] for record in self.stages),
+        }))
+
+    def write_prometheus_textfile(self, filename):
+        """
+        Write the run metrics for the node_exporter textfile collector.
+        """
+        metrics = [
+            ('seconds', 'eps_noms_stage_duration_seconds', 'Stage wall time'),
+            ('bytes_in', 'eps_noms_stage_bytes_in', 'Bytes read by the stage'),
+            ('bytes_out', 'eps_noms_stage_bytes_out', 'Bytes written by the stage'),
+            ('rows', 'eps_noms_stage_rows', 'Rows handled by the stage'),
+            ('retries', 'eps_noms_stage_retries', 'Network calls retried during the stage'),
+            ('peak_rss_bytes', 'eps_noms_stage_peak_rss_bytes', 'Peak RSS during the stage'),
+            ('ok', 'eps_noms_stage_success', 'Whether the stage succeeded'),
+        ]
+        lines = []
+        for key, metric, description in metrics:
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} gauge")
+            for record in self.stages:
+                if record.get(key) is None:
+                    continue
+                labels = f'stage="{record["stage"]}"'
+                if record['week']:
+                    labels += f',week="{record["week"]}"'
+                lines.append(f"{metric}{{{labels}}} {float(record[key])}")
+        lines.append("# HELP eps_noms_last_run_timestamp_seconds Start time of the last run")
+        lines.append("# TYPE eps_noms_last_run_timestamp_seconds gauge")
+        lines.append(f"eps_noms_last_run_timestamp_seconds {self.started_at}")
+
+        # Write then rename so the collector never reads a partial file
+        temp_file = f"{filename}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(temp_file, filename)
+        print(f"Wrote Prometheus metrics to {filename}")
+
+def get_file_size(*filenames):
+    """
+    Total size of the given files that exist.
+    """
+    return sum(os.path.getsize(filename) for filename in filenames if filename and os.path.exists(filename))
+
+def upload_quarantine(quarantine, quarantine_filename, blob_name, storage_context, args, metrics, week):
+    """
+    Write the rows that failed validation to CSV and upload them under
+    QUARANTINE_BLOB_PREFIX. Returns True on success.
+    """
+    with metrics.stage('upload_quarantine', week) as stage:
+        quarantine.write_csv(quarantine_filename)
+        stage['ok'] = upload_to_gcp(storage_context, quarantine_filename, blob_name, compress=args.gzip_upload,
+                                    chunk_size=args.upload_chunk_size * 1024 * 1024)
+        stage.update(rows=len(quarantine), bytes_in=get_file_size(quarantine_filename))
+    if not stage['ok']:
+        print("Failed to upload quarantined rows to GCP. Exiting Process.")
+    return stage['ok']
+
+def load_week_to_bigquery(bigquery_writer, metrics, week):
+    """
+    Run the BigQuery load stage for rows staged during the transform.
+    Returns the number of rows loaded, or None on failure.
+    """
+    with metrics.stage('bigquery_load', week) as stage:
+        loaded_rows = bigquery_writer.load()
+        stage.update(ok=loaded_rows is not None, rows=loaded_rows, bytes_in=bigquery_writer.bytes_written)
+    if loaded_rows is None:
+        print("Failed to load rows into BigQuery. Exiting Process.")
+    return loaded_rows
+
+def upload_week_delta(report_date, csv_filename, delta_base, args, storage_context, metrics):
+    """
+    Build the rows of a week's CSV snapshot inserted, changed and removed
+    since delta_base (base_date, manifest entry) and upload them under
+    DELTA_BLOB_PREFIX.
+    Returns the delta fields of the week's manifest entry, or None on failure.
+    """
+    week = report_date.strftime('%Y-%m-%d')
+    base_date, base_entry = delta_base
+    local_delta_filename = (generate_filename(DELTA_FILENAME, report_date).replace('-', '+')
+                            .replace('.xlsx', '.csv'))
+    gcp_delta_blob_name = f"{DELTA_BLOB_PREFIX}{local_delta_filename}"
+
+    with metrics.stage('delta', week) as stage:
+        snapshot = fetch_snapshot_csv(storage_context, base_date, base_entry)
+        counts = None
+        if snapshot is not None:
+            previous_csv_filename, is_temporary = snapshot
+            counts = export_delta(previous_csv_filename, csv_filename, local_delta_filename)
+            stage['bytes_in'] = get_file_size(previous_csv_filename, csv_filename)
+            if is_temporary:
+                cleanup_files([previous_csv_filename])
+        stage.update(ok=bool(counts), bytes_out=get_file_size(local_delta_filename))
+        if counts:
+            stage['rows'] = sum(counts.values())
+    if not stage['ok']:
+        print("Failed to build delta. Exiting Process.")
+        return None
+    with metrics.stage('upload_delta', week) as stage:
+        stage['ok'] = upload_to_gcp(storage_context, local_delta_filename, gcp_delta_blob_name,
+                                    compress=args.gzip_upload, chunk_size=args.upload_chunk_size * 1024 * 1024)
+        stage['bytes_in'] = get_file_size(local_delta_filename)
+    if not stage['ok']:
+        print("Failed to upload delta to GCP. Exiting Process.")
+        return None
+    return {
+        'delta_blob': gcp_delta_blob_name,
+        'delta_base': base_date.strftime('%Y-%m-%d'),
+        'delta_base_sha256': base_entry.get('sha256'),
+        'delta_changes': counts,
+    }
+
+def transform_and_upload_report(report_date, local_excel_filename, args, link_index, storage_context, metrics,
+                                delta_base=None):
+    """
+    Transform a downloaded report and upload the outputs for a single week.
+    If delta_base (base_date, manifest entry) is given, the changes since that
+    week are also uploaded under DELTA_BLOB_PREFIX.
+    Returns the manifest entry for the week, or None on failure.
+    """
+    week = report_date.strftime('%Y-%m-%d')
+
+    # Generate filenames - Note we use - for download but + for GCP
+    source_filename = generate_filename(BASE_FILENAME, report_date)  # Will have - for download
+    gcp_filename = source_filename.replace('-', '+')  # Convert to + for GCP storage
+
+    modified_excel_filename = f"modified_{source_filename}"
+    local_csv_filename = gcp_filename.replace('.xlsx', '.csv')  # Use + version for CSV
+    local_parquet_filename = gcp_filename.replace('.xlsx', '.parquet')
+    gcp_csv_blob_name = f"{BLOB_PREFIX}{gcp_filename[:-5]}.csv"  # Use + version for GCP
+    gcp_parquet_blob_name = f"{BLOB_PREFIX}{gcp_filename[:-5]}.parquet"
+    local_delta_filename = local_csv_filename.replace(BASE_FILENAME, DELTA_FILENAME)
+    local_quarantine_filename = local_csv_filename.replace(BASE_FILENAME, QUARANTINE_FILENAME)
+    gcp_quarantine_blob_name = f"{QUARANTINE_BLOB_PREFIX}{local_quarantine_filename}"
+
+    write_csv = args.output_format in ('csv', 'both')
+    write_parquet = args.output_format in ('parquet', 'both')
+    csv_filename = local_csv_filename if write_csv else None
+    parquet_filename = local_parquet_filename if write_parquet else None
+    bigquery_writer = BigQueryRowWriter(args.bigquery_context, week) if args.bigquery_context else None
+    quarantine = Quarantine()
+
+    if args.pipelined:
+        with metrics.stage('transform_upload', week) as stage:
+            result = stream_dispenser_rows_to_gcs(
+                local_excel_filename, storage_context,
+                csv_blob_name=gcp_csv_blob_name if write_csv else None,
+                parquet_blob_name=gcp_parquet_blob_name if write_parquet else None,
+                reader=args.reader, compress=args.gzip_upload, chunk_size=args.upload_chunk_size * 1024 * 1024,
+                bigquery_writer=bigquery_writer, quarantine=quarantine,
+            )
+            stage['ok'] = result is not None
+            stage['bytes_in'] = get_file_size(local_excel_filename)
+            if result is not None:
+                stage.update(rows=result['rows'], bytes_out=result['bytes_out'])
+        if result is None:
+            print("Failed to stream xlsx to GCP. Exiting Process.")
+            return None
+        entry = {
+            'rows': result['rows'],
+            'source_url': link_index.get(report_date.strftime('%y%m%d')),
+            'processed_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        if write_csv:
+            entry.update(blob=gcp_csv_blob_name, sha256=result['csv_sha256'])
+            if write_parquet:
+                entry.update(parquet_blob=gcp_parquet_blob_name, parquet_sha256=result['parquet_sha256'])
+        else:
+            entry.update(blob=gcp_parquet_blob_name, sha256=result['parquet_sha256'])
+        if quarantine:
+            if not upload_quarantine(quarantine, local_quarantine_filename, gcp_quarantine_blob_name, storage_context,
+                                     args, metrics, week):
+                return None
+            entry.update(quarantine_blob=gcp_quarantine_blob_name, quarantined_rows=len(quarantine))
+        if bigquery_writer is not None:
+            loaded_rows = load_week_to_bigquery(bigquery_writer, metrics, week)
+            if loaded_rows is None:
+                return None
+            entry.update(bigquery_table=args.bigquery_context.table_id, bigquery_rows=loaded_rows)
+        print(f"Process successfully complete for {week}")
+        return entry
+
+    extract_rows = None
+    if args.extract_sheets:
+        extract_blob_names = [
+            sheet['blob'].format(yymmdd=report_date.strftime('%y%m%d'), week=week) for sheet in args.extract_sheets
+        ]
+        extract_filenames = [os.path.basename(blob_name) for blob_name in extract_blob_names]
+
+    if args.engine == 'stream':
+        dispenser_outputs = {
+            'csv_filename': csv_filename,
+            'parquet_filename': parquet_filename,
+            'modified_excel_filename': modified_excel_filename if args.save_modified_excel else None,
+            'bigquery_writer': bigquery_writer,
+        }
+        with metrics.stage('transform', week) as stage:
+            if args.extract_sheets:
+                # The configured sheets are extracted in the same pass over the workbook
+                result = extract_sheets(local_excel_filename, args.extract_sheets, extract_filenames, args.reader,
+                                        dispenser_outputs, quarantine)
+                row_count, extract_rows = result or (None, None)
+                bytes_out = get_file_size(csv_filename, parquet_filename, *extract_filenames)
+            else:
+                row_count = export_dispenser_rows(local_excel_filename, reader=args.reader, quarantine=quarantine,
+                                                  **dispenser_outputs)
+                bytes_out = get_file_size(csv_filename, parquet_filename)
+            stage.update(ok=row_count is not None, rows=row_count, bytes_in=get_file_size(local_excel_filename),
+                         bytes_out=bytes_out)
+        if row_count is None:
+            print("Failed to stream xlsx to CSV/Parquet. Exiting Process.")
+            return None
+    elif args.engine == 'frame':
+        with metrics.stage('transform', week) as stage:
+            try:
+                frame, csv_header = load_dispenser_frame(local_excel_filename, args.reader, quarantine)
+                stage.update(rows=len(frame), bytes_in=get_file_size(local_excel_filename))
+            except Exception as e:
+                print(f"Error loading Excel file into frame: {e}")
+                stage['ok'] = False
+        if not stage['ok']:
+            print("Failed to transform xlsx. Exiting Process.")
+            return None
+        row_count = len(frame)
+        with metrics.stage('export', week) as stage:
+            stage['ok'] = write_frame_outputs(
+                frame, csv_header, csv_filename=csv_filename, parquet_filename=parquet_filename,
+                modified_excel_filename=modified_excel_filename if args.save_modified_excel else None)
+            stage.update(rows=row_count, bytes_out=get_file_size(csv_filename, parquet_filename))
+        if not stage['ok']:
+            print("Failed to write CSV/Parquet. Exiting Process.")
+            return None
+    else:
+        with metrics.stage('transform', week) as stage:
+            modified_workbook = modify_excel(local_excel_filename, quarantine)
+            stage.update(ok=modified_workbook is not None, bytes_in=get_file_size(local_excel_filename))
+        if modified_workbook is None:
+            print("Failed to modify Excel file. Exiting Process.")
+            return None
+        row_count = modified_workbook[DISPENSER_SHEET].max_row - 1
+        if args.save_modified_excel:
+            with metrics.stage('save', week) as stage:
+                stage['ok'] = save_excel(modified_workbook, modified_excel_filename)
+                stage['bytes_out'] = get_file_size(modified_excel_filename)
+            if not stage['ok']:
+                print("Failed to save modified Excel file. Exiting Process.")
+                return None
+        with metrics.stage('export', week) as stage:
+            stage['ok'] = ((not write_csv or excel_to_csv(modified_workbook, local_csv_filename))
+                           and (not write_parquet or excel_to_parquet(modified_workbook, local_parquet_filename)))
+            stage.update(rows=row_count, bytes_out=get_file_size(csv_filename, parquet_filename))
+        if not stage['ok']:
+            print("Failed to convert xlsx to CSV/Parquet. Exiting Process.")
+            return None
+
+    entry = {
+        'rows': row_count,
+        'source_url': link_index.get(report_date.strftime('%y%m%d')),
+        'processed_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    if write_parquet:
+        with metrics.stage('upload_parquet', week) as stage:
+            stage['ok'] = upload_to_gcp(storage_context, local_parquet_filename, gcp_parquet_blob_name,
+                                        chunk_size=args.upload_chunk_size * 1024 * 1024,
+                                        content_type='application/vnd.apache.parquet')
+            stage['bytes_in'] = get_file_size(local_parquet_filename)
+        if not stage['ok']:
+            print("Failed to upload Parquet to GCP. Exiting Process.")
+            return None
+        entry['blob'] = gcp_parquet_blob_name
+        entry['sha256'] = file_sha256(local_parquet_filename)
+    if write_csv:
+        with metrics.stage('upload_csv', week) as stage:
+            stage['ok'] = upload_to_gcp(storage_context, local_csv_filename, gcp_csv_blob_name,
+                                        compress=args.gzip_upload, chunk_size=args.upload_chunk_size * 1024 * 1024)
+            stage['bytes_in'] = get_file_size(local_csv_filename)
+        if not stage['ok']:
+            print("Failed to upload CSV to GCP. Exiting Process.")
+            return None
+        if write_parquet:
+            entry['parquet_blob'] = entry['blob']
+            entry['parquet_sha256'] = entry['sha256']
+        entry['blob'] = gcp_csv_blob_name
+        entry['sha256'] = file_sha256(local_csv_filename)
+    if quarantine:
+        if not upload_quarantine(quarantine, local_quarantine_filename, gcp_quarantine_blob_name, storage_context,
+                                 args, metrics, week):
+            return None
+        entry['quarantine_blob'] = gcp_quarantine_blob_name
+        entry['quarantined_rows'] = len(quarantine)
+    if bigquery_writer is not None:
+        loaded_rows = load_week_to_bigquery(bigquery_writer, metrics, week)
+        if loaded_rows is None:
+            return None
+        entry['bigquery_table'] = args.bigquery_context.table_id
+        entry['bigquery_rows'] = loaded_rows
+
+    if args.extract_sheets:
+        if extract_rows is None:
+            # Only the stream engine extracts in its own pass over the workbook
+            with metrics.stage('extract', week) as stage:
+                result = extract_sheets(local_excel_filename, args.extract_sheets, extract_filenames, args.reader)
+                extract_rows = result and result[1]
+                stage.update(ok=extract_rows is not None, bytes_in=get_file_size(local_excel_filename),
+                             bytes_out=get_file_size(*extract_filenames))
+                if extract_rows is not None:
+                    stage['rows'] = sum(extract_rows.values())
+            if extract_rows is None:
+                print("Failed to extract configured sheets. Exiting Process.")
+                return None
+        entry['extracts'] = {}
+        with metrics.stage('upload_extracts', week) as stage:
+            for sheet, blob_name, extract_filename in zip(args.extract_sheets, extract_blob_names, extract_filenames):
+                is_parquet = extract_filename.endswith('.parquet')
+                stage['ok'] = upload_to_gcp(
+                    storage_context, extract_filename, blob_name, compress=args.gzip_upload and not is_parquet,
+                    chunk_size=args.upload_chunk_size * 1024 * 1024,
+                    content_type='application/vnd.apache.parquet' if is_parquet else 'text/csv')
+                if not stage['ok']:
+                    break
+                entry['extracts'][sheet['sheet']] = {
+                    'blob': blob_name,
+                    'rows': extract_rows[sheet['sheet']],
+                    'sha256': file_sha256(extract_filename),
+                }
+            stage['bytes_in'] = get_file_size(*extract_filenames)
+        if not stage['ok']:
+            print("Failed to upload extracted sheets to GCP. Exiting Process.")
+            return None
+
+    if delta_base is not None:
+        delta_entry = upload_week_delta(report_date, local_csv_filename, delta_base, args, storage_context, metrics)
+        if delta_entry is None:
+            return None
+        entry.update(delta_entry)
+
+    print(f"Process successfully complete for {week}")
+
+    """
+    # Clean up
+    cleanup_files([
+        local_excel_filename,
+        modified_excel_filename,
+        local_csv_filename,
+        local_parquet_filename,
+        local_delta_filename,
+        local_quarantine_filename
+    ])
+    """
+    return entry
+
+def entry_has_outputs(entry, report_date, args, delta_base=None):
+    """
+    Check whether a manifest entry already has every output the options ask
+    for: the output format, the BigQuery load, the sheet extracts and the delta.
+    """
+    blobs = [entry.get('blob', ''), entry.get('parquet_blob', '')]
+    if args.output_format in ('csv', 'both') and not entry.get('blob', '').endswith('.csv'):
+        return False
+    if args.output_format in ('parquet', 'both') and not any(blob.endswith('.parquet') for blob in blobs):
+        return False
+    if args.bigquery_context is not None and entry.get('bigquery_table') != args.bigquery_context.table_id:
+        return False
+    for sheet in args.extract_sheets or []:
+        blob_name = sheet['blob'].format(yymmdd=report_date.strftime('%y%m%d'), week=report_date.strftime('%Y-%m-%d'))
+        if entry.get('extracts', {}).get(sheet['sheet'], {}).get('blob') != blob_name:
+            return False
+    if delta_base is not None:
+        base_date, base_entry = delta_base
+        if (entry.get('delta_base') != base_date.strftime('%Y-%m-%d')
+                or entry.get('delta_base_sha256') != base_entry.get('sha256')):
+            return False
+    return True
+
+def process_report(report_date, args, session, link_index, storage_context, metrics, content_cache=None,
+                   previous_entry=None, delta_base=None):
+    """
+    Download, transform and upload the report for a single week.
+    A download whose SHA-256 matches previous_entry or the content cache is
+    not transformed or uploaded again, and that entry is returned as is,
+    as long as it has every output the options ask for (entry_has_outputs).
+    delta_base is passed on to transform_and_upload_report.
+    Returns the manifest entry for the week, or None on failure.
+    """
+    week = report_date.strftime('%Y-%m-%d')
+    local_excel_filename = generate_filename(BASE_FILENAME, report_date)  # Will have - for download
+
+    # Download and process the file
+    with metrics.stage('download', week) as stage:
+        stage['ok'] = download_excel(BASE_URL, local_excel_filename, session=session, link_index=link_index)
+        stage['bytes_out'] = get_file_size(local_excel_filename)
+    if not stage['ok']:
+        print("Failed to download Excel file. Exiting.")
+        return None
+
+    source_sha256 = file_sha256(local_excel_filename)
+    unchanged = previous_entry is not None and previous_entry.get('source_sha256') == source_sha256
+    if unchanged and entry_has_outputs(previous_entry, report_date, args, delta_base):
+        print(f"{local_excel_filename} unchanged since it was processed (sha256 {source_sha256}). "
+              f"Skipping transform and upload.")
+        return previous_entry
+    if content_cache is not None:
+        cached_entry = content_cache.lookup(source_sha256, week, args.output_format)
+        if cached_entry is not None and entry_has_outputs(cached_entry, report_date, args, delta_base):
+            print(f"{local_excel_filename} matches cached workbook {source_sha256} already uploaded as "
+                  f"{cached_entry['blob']}. Skipping transform and upload.")
+            return cached_entry
+    if unchanged:
+        print(f"{local_excel_filename} unchanged since it was processed, but without every output asked for, "
+              f"reprocessing")
+    elif previous_entry is not None:
+        print(f"{local_excel_filename} has changed since it was processed, reprocessing")
+
+    entry = transform_and_upload_report(report_date, local_excel_filename, args, link_index, storage_context, metrics,
+                                        delta_base)
+    if entry is None:
+        return None
+    entry['source_sha256'] = source_sha256
+    if content_cache is not None:
+        content_cache.add(local_excel_filename, source_sha256, week, args.output_format, entry)
+    return entry
+
+def run_backfill(start_date, end_date, args, session, link_index, storage_context, manifest, metrics,
+                 content_cache=None):
+    """
+    Process every missing week between start_date and end_date concurrently.
+    With args.recheck every week is downloaded again and reprocessed if it changed.
+    With args.delta the deltas are built afterwards, oldest week first, once
+    every week's snapshot exists, so each is against the week before it.
+    """
+    report_dates = get_report_dates(start_date, end_date)
+    processed_dates = {processed_date.date() for processed_date in get_manifest_dates(manifest)}
+    if args.recheck:
+        missing_dates = report_dates
+    else:
+        missing_dates = [report_date for report_date in report_dates if report_date.date() not in processed_dates]
+    print(f"Backfill {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}: "
+          f"{len(report_dates)} weeks, {len(missing_dates)} {'to recheck' if args.recheck else 'missing'}")
+    if not missing_dates:
+        return True
+
+    failed_dates = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(process_report, report_date, args, session, link_index, storage_context, metrics,
+                            content_cache, manifest['weeks'].get(report_date.strftime('%Y-%m-%d'))): report_date
+            for report_date in missing_dates
+        }
+        for future in as_completed(futures):
+            report_date = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                print(f"Error processing {report_date.strftime('%Y-%m-%d')}: {e}")
+                entry = None
+            if entry is None:
+                failed_dates.append(report_date)
+            else:
+                record_processed_week(manifest, report_date, entry)
+
+    if args.delta:
+        for report_date in sorted(set(missing_dates) - set(failed_dates)):
+            entry = manifest['weeks'][report_date.strftime('%Y-%m-%d')]
+            delta_base = get_delta_base(manifest, report_date)
+            if delta_base is None or (entry.get('delta_base') == delta_base[0].strftime('%Y-%m-%d')
+                                      and entry.get('delta_base_sha256') == delta_base[1].get('sha256')):
+                # First week, or unchanged since its delta was built against the same snapshot
+                continue
+            snapshot = fetch_snapshot_csv(storage_context, report_date, entry)
+            delta_entry = snapshot and upload_week_delta(report_date, snapshot[0], delta_base, args,
+                                                         storage_context, metrics)
+            if snapshot and snapshot[1]:
+                cleanup_files([snapshot[0]])
+            if delta_entry:
+                entry.update(delta_entry)
+            else:
+                failed_dates.append(report_date)
+
+    with metrics.stage('manifest_save'):
+        save_manifest(storage_context, manifest)
+
+    for report_date in sorted(failed_dates):
+        print(f"Backfill failed for {report_date.strftime('%Y-%m-%d')}")
+    print(f"Backfill complete: {len(missing_dates) - len(failed_dates)} of {len(missing_dates)} weeks processed")
+    return not failed_dates
+
+def get_reprocess_sources(sources, storage_context):
+    """
+    Expand --reprocess arguments into (report_date, source, size) for every
+    eps_nom_report workbook: local files, local directories, gs:// objects and
+    gs:// prefixes ending in '/'. Local paths must already be absolute.
+    """
+    workbooks = []
+    for source in sources:
+        if source.startswith('gs://'):
+            bucket_name, _, blob_name = source[len('gs://'):].partition('/')
+            bucket = StorageContext(bucket_name, client=storage_context.client).bucket
+            if source.endswith('/'):
+                blobs = transport.call(
+                    GCS_HOST, lambda: list(bucket.list_blobs(prefix=blob_name, timeout=GCS_TIMEOUT, retry=None)))
+            else:
+                blobs = [transport.call(GCS_HOST, bucket.get_blob, blob_name, timeout=GCS_TIMEOUT, retry=None)]
+                if blobs[0] is None:
+                    print(f"{source} not found, skipping")
+                    continue
+            candidates = [(blob.name, f"gs://{bucket_name}/{blob.name}", blob.size) for blob in blobs]
+        elif os.path.isdir(source):
+            candidates = [
+                (filename, os.path.join(source, filename), os.path.getsize(os.path.join(source, filename)))
+                for filename in sorted(os.listdir(source))
+            ]
+        elif os.path.exists(source):
+            candidates = [(source, source, os.path.getsize(source))]
+        else:
+            print(f"{source} not found, skipping")
+            continue
+
+        for name, path, size in candidates:
+            match = REPROCESS_SOURCE_PATTERN.search(name)
+            if match:
+                workbooks.append((datetime.strptime(match.group(1), '%y%m%d'), path, size or 0))
+            elif path == source:
+                print(f"{source} is not an eps_nom_report workbook, skipping")
+    return workbooks
+
+def fetch_reprocess_source(source, local_filename, storage_context):
+    """
+    Put a --reprocess workbook at local_filename in the working directory,
+    downloading gs:// objects and hard linking (or copying) local files.
+    """
+    try:
+        if source.startswith('gs://'):
+            bucket_name, _, blob_name = source[len('gs://'):].partition('/')
+            blob = StorageContext(bucket_name, client=storage_context.client).blob(blob_name)
+            transport.call(GCS_HOST, blob.download_to_filename, local_filename, timeout=GCS_TIMEOUT, retry=None)
+        elif os.path.abspath(source) != os.path.abspath(local_filename):
+            if os.path.exists(local_filename):
+                os.remove(local_filename)
+            try:
+                os.link(source, local_filename)
+            except OSError:
+                shutil.copyfile(source, local_filename)
+        return True
+    except Exception as e:
+        print(f"Error fetching {source}: {e}")
+        return False
+
+def reprocess_workbook(report_date, source, args, link_index):
+    """
+    Process pool task for run_reprocess: fetch, transform and upload one
+    workbook in its own process, with its own storage client.
+    Returns (manifest entry or None, stage records).
+    """
+    week = report_date.strftime('%Y-%m-%d')
+    metrics = RunMetrics()
+    storage_context = StorageContext(GCP_BUCKET_NAME)
+    if args.bigquery_table:
+        args.bigquery_context = BigQueryContext(args.bigquery_table)
+    local_excel_filename = generate_filename(BASE_FILENAME, report_date)
+
+    with metrics.stage('fetch_source', week) as stage:
+        stage['ok'] = fetch_reprocess_source(source, local_excel_filename, storage_context)
+        stage['bytes_out'] = get_file_size(local_excel_filename)
+    if not stage['ok']:
+        return None, metrics.stages
+
+    entry = transform_and_upload_report(report_date, local_excel_filename, args, link_index, storage_context, metrics)
+    if entry is not None:
+        entry['source_sha256'] = file_sha256(local_excel_filename)
+    return entry, metrics.stages
+
+def run_reprocess(args, metrics):
+    """
+    Reprocess a set of workbooks (e.g. after a transform change) on every
+    core. Each workbook is transformed and uploaded in a worker process;
+    workbooks are only started while their estimated peak memory fits in
+    args.reprocess_memory, so the legacy engine cannot exhaust RAM. The
+    per-workbook manifest entries are merged and saved once at the end.
+    """
+    # Resolve local paths before the working directory changes
+    sources = [source if source.startswith('gs://') else os.path.abspath(source) for source in args.reprocess]
+    storage_context = StorageContext(GCP_BUCKET_NAME)
+    work_dir = setup_working_directory()
+    print(f"Files will be processed in: {work_dir}")
+
+    with metrics.stage('auth') as stage:
+        stage['ok'] = authentication(storage_context)
+    if not stage['ok']:
+        print("Authentication failed. Exiting.")
+        return False
+    with metrics.stage('bucket_listing') as stage:
+        manifest = load_manifest(storage_context)
+        stage['rows'] = len(manifest['weeks'])
+
+    workbooks = {}
+    for report_date, source, size in get_reprocess_sources(sources, storage_context):
+        week = report_date.strftime('%Y-%m-%d')
+        if week in workbooks:
+            print(f"More than one workbook for {week}, using {source} instead of {workbooks[week][1]}")
+        workbooks[week] = (report_date, source, size)
+    if not workbooks:
+        print("No workbooks to reprocess")
+        return False
+
+    # Keep the source URLs already recorded, the statistics page may no longer link old weeks
+    link_index = {
+        datetime.strptime(week, '%Y-%m-%d').strftime('%y%m%d'): entry['source_url']
+        for week, entry in manifest['weeks'].items() if entry.get('source_url')
+    }
+    # The BigQuery context holds a lock, so each worker creates its own
+    worker_args = argparse.Namespace(**{**vars(args), 'bigquery_context': None})
+    memory_budget = args.reprocess_memory * 1024 * 1024
+    memory_factor = REPROCESS_MEMORY_FACTORS[args.engine]
+    pending = [workbooks[week] for week in sorted(workbooks)]
+    print(f"Reprocessing {len(pending)} workbooks with {args.processes} processes "
+          f"and {args.reprocess_memory} MiB of memory")
+
+    entries = {}
+    failed_dates = []
+    in_flight = {}
+    in_flight_memory = 0
+    with ProcessPoolExecutor(max_workers=args.processes,
+                             mp_context=multiprocessing.get_context(REPROCESS_START_METHOD),
+                             max_tasks_per_child=REPROCESS_TASKS_PER_CHILD) as executor:
+        while pending or in_flight:
+            # Always run at least one workbook, however large, so the batch cannot stall
+            while pending and len(in_flight) < args.processes:
+                report_date, source, size = pending[0]
+                estimate = REPROCESS_PROCESS_MEMORY + size * memory_factor
+                if in_flight and in_flight_memory + estimate > memory_budget:
+                    break
+                pending.pop(0)
+                try:
+                    future = executor.submit(reprocess_workbook, report_date, source, worker_args, link_index)
+                except BrokenProcessPool as e:
+                    # A worker was killed (e.g. out of memory), so no more can be started
+                    print(f"Process pool stopped ({e}), not starting the remaining workbooks")
+                    failed_dates.extend([report_date, *(workbook[0] for workbook in pending)])
+                    pending = []
+                    break
+                in_flight[future] = (report_date, estimate)
+                in_flight_memory += estimate
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                report_date, estimate = in_flight.pop(future)
+                in_flight_memory -= estimate
+                try:
+                    entry, stages = future.result()
+                    metrics.stages.extend(stages)
+                except Exception as e:
+                    print(f"Error reprocessing {report_date.strftime('%Y-%m-%d')}: {e}")
+                    entry = None
+                if entry is None:
+                    failed_dates.append(report_date)
+                else:
+                    entries[report_date] = entry
+
+    for report_date, entry in sorted(entries.items()):
+        record_processed_week(manifest, report_date, entry)
+    if entries:
+        with metrics.stage('manifest_save') as stage:
+            stage['ok'] = save_manifest(storage_context, manifest)
+
+    for report_date in sorted(failed_dates):
+        print(f"Reprocess failed for {report_date.strftime('%Y-%m-%d')}")
+    print(f"Reprocess complete: {len(entries)} of {len(workbooks)} workbooks processed")
+    return not failed_dates
+
+def parse_date(value):
+    """
+    Parse a YYYY-MM-DD command line date.
+    """
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date '{value}', expected YYYY-MM-DD")
+
+def parse_args(argv=None):
+    """
+    Parse command line options for the pipeline.
+    """
+    parser = argparse.ArgumentParser(description="Process the weekly NHS EPS nominations report.")
+    parser.add_argument('--engine', choices=('stream', 'frame', 'legacy'), default='stream',
+                        help="Transform engine: stream rows (flat memory), load the sheet into a DataFrame "
+                             "and transform whole columns, or the original openpyxl edit mode")
+    parser.add_argument('--pipelined', action='store_true',
+                        help="Stream rows from the stream engine straight into resumable uploads "
+                             "while the sheet is read, without local CSV/Parquet files")
+    parser.add_argument('--reader', choices=tuple(WORKBOOK_READERS), default='openpyxl',
+                        help="xlsx reader backend for the stream and frame engines")
+    parser.add_argument('--check-reader-parity', metavar='XLSX',
+                        help="Compare the --reader backend against openpyxl for a local workbook and exit")
+    parser.add_argument('--save-modified-excel', action='store_true',
+                        help="Also write the modified_*.xlsx artifact (nothing downstream reads it)")
+    parser.add_argument('--async-check', action='store_true',
+                        help="Authenticate, load the manifest and fetch the statistics page concurrently, "
+                             "deciding whether to skip as soon as possible")
+    parser.add_argument('--recheck', action='store_true',
+                        help="Download weeks that were already processed again and reprocess any "
+                             "that NHS has republished with different content")
+    parser.add_argument('--cache-size', type=int, default=CONTENT_CACHE_SIZE // (1024 * 1024),
+                        help=f"Size limit in MiB of the local workbook cache in {CONTENT_CACHE_DIR}/ (0 disables it)")
+    parser.add_argument('--check-only', action='store_true',
+                        help="Only check whether a new report is waiting, from the local manifest and the "
+                             "statistics page, and exit 0 if up to date, 1 if there is work, 2 on error")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Keep running with warm connections, polling for each Monday release "
+                             "instead of being run by cron")
+    parser.add_argument('--poll-interval', type=int, default=DAEMON_POLL_INTERVAL,
+                        help="Minutes between statistics page checks while a release is due (--daemon)")
+    parser.add_argument('--backfill', nargs=2, metavar=('FROM', 'TO'), type=parse_date,
+                        help="Process every missing week between two dates (YYYY-MM-DD)")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Number of weeks processed concurrently during a backfill")
+    parser.add_argument('--reprocess', nargs='+', metavar='SOURCE',
+                        help="Transform and upload these workbooks again in a process pool: local "
+                             "eps_nom_report-YYMMDD.xlsx files or directories, gs:// objects or gs:// prefixes ending in /")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help="Worker processes for --reprocess")
+    parser.add_argument('--reprocess-memory', type=int,
+                        help="MiB of memory the --reprocess workers may use between them, estimated from "
+                             "workbook size and engine (default: half the physical memory)")
+    parser.add_argument('--output-format', choices=('csv', 'parquet', 'both'), default='csv',
+                        help="Write the Dispenser Nominations rows as CSV, typed Parquet, or both")
+    parser.add_argument('--extract-config', metavar='JSON',
+                        help="Also extract the sheets listed in this config (sheet, transform, blob) "
+                             "in one pass over the workbook; --reader xml reads them in parallel")
+    parser.add_argument('--delta', action='store_true',
+                        help="Also upload the rows inserted, changed and removed since the previous "
+                             f"processed week, keyed on {DELTA_KEY_COLUMN}, under {DELTA_BLOB_PREFIX}")
+    parser.add_argument('--bigquery-table', metavar='PROJECT.DATASET.TABLE',
+                        help="Also load the Dispenser Nominations rows into this BigQuery table, partitioned "
+                             "on Week, replacing the week's partition on each load (stream engine only)")
+    parser.add_argument('--gzip-upload', action='store_true',
+                        help="Store uploaded CSVs gzip encoded")
+    parser.add_argument('--upload-chunk-size', type=int, default=UPLOAD_CHUNK_SIZE // (1024 * 1024),
+                        help="Resumable/parallel upload chunk size in MiB")
+    parser.add_argument('--metrics-textfile', metavar='PATH',
+                        help="Also write run metrics in Prometheus textfile format")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"Profile the run with cProfile (saved to {PROFILE_FILE}) and track allocations with tracemalloc")
+    args = parser.parse_args(argv)
+    if args.pipelined and (args.engine != 'stream' or args.save_modified_excel):
+        parser.error("--pipelined needs --engine stream and no --save-modified-excel")
+    if args.delta and (args.pipelined or args.output_format == 'parquet'):
+        parser.error("--delta compares local CSV snapshots, so needs CSV output and no --pipelined")
+    if args.daemon and (args.backfill or args.profile or args.recheck or args.async_check):
+        parser.error("--daemon cannot be combined with --backfill, --profile, --recheck or --async-check")
+    if args.reprocess and (args.backfill or args.daemon or args.delta):
+        parser.error("--reprocess cannot be combined with --backfill, --daemon or --delta")
+    if args.reprocess_memory is None:
+        args.reprocess_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (2 * 1024 * 1024)
+    if args.pipelined and args.extract_config:
+        parser.error("--extract-config writes local files, so is not available with --pipelined")
+    if args.bigquery_table and args.engine != 'stream':
+        parser.error("--bigquery-table loads rows as the stream engine writes them, so needs --engine stream")
+    args.bigquery_context = BigQueryContext(args.bigquery_table) if args.bigquery_table else None
+    args.extract_sheets = None
+    if args.extract_config:
+        try:
+            args.extract_sheets = load_extract_config(args.extract_config)
+        except (OSError, ValueError) as e:
+            parser.error(f"Invalid --extract-config: {e}")
+    return args
+
+def get_link_index(session, metrics):
+    """
+    Fetch the report link index, recording the page fetch stage.
+    Returns None if the statistics page could not be fetched.
+    """
+    with metrics.stage('page_fetch') as stage:
+        try:
+            link_index = get_report_link_index(session, BASE_URL)
+            stage['rows'] = len(link_index)
+        except (requests.RequestException, CircuitOpenError) as e:
+            print(f"Error fetching statistics page: {e}")
+            stage['ok'] = False
+            link_index = None
+    return link_index
+
+def get_target_blob_name(report_date, output_format='csv'):
+    """
+    Name of the blob recorded for a week in the manifest (the CSV, or the Parquet
+    file when only Parquet is written).
+    """
+    gcp_filename = generate_filename(BASE_FILENAME, report_date).replace('-', '+')
+    extension = 'parquet' if output_format == 'parquet' else 'csv'
+    return f"{BLOB_PREFIX}{gcp_filename[:-5]}.{extension}"
+
+def is_report_processed(manifest, report_date):
+    """
+    Check whether the manifest already covers report_date.
+    """
+    processed_dates = get_manifest_dates(manifest)
+    latest_processed_date = max(processed_dates) if processed_dates else None
+
+    # Print dates for debugging
+    print(f"Latest processed date: {latest_processed_date}")
+    print(f"Current report date: {report_date}")
+    return latest_processed_date is not None and report_date.date() <= latest_processed_date.date()
+
+def fetch_and_check(report_date, args, session, storage_context, metrics):
+    """
+    Authenticate, load the manifest and, unless report_date is already
+    processed (or args.recheck is set), fetch the statistics page, one after another.
+    report_date is None for a backfill, which always needs the page.
+    Returns (decision, manifest, link_index), decision being 'skip', 'process' or 'failed'.
+    """
+    with metrics.stage('auth') as stage:
+        stage['ok'] = authentication(storage_context)
+    if not stage['ok']:
+        print("Authentication failed. Exiting.")
+        return 'failed', None, None
+
+    # Check processed weeks in GCP
+    with metrics.stage('bucket_listing') as stage:
+        manifest = load_manifest(storage_context)
+        stage['rows'] = len(manifest['weeks'])
+
+    if report_date is not None and not args.recheck and is_report_processed(manifest, report_date):
+        print("Already have the latest file processed. Skipping download.")
+        return 'skip', manifest, None
+
+    link_index = get_link_index(session, metrics)
+    if link_index is None:
+        print("Failed to download Excel file. Exiting.")
+        return 'failed', manifest, None
+    return 'process', manifest, link_index
+
+async def fetch_and_check_async(report_date, args, session, storage_context, metrics):
+    """
+    Same as fetch_and_check, but the statistics page fetch runs alongside
+    authentication, and the manifest load alongside a check for the week's blob.
+    An existing blob or an up to date manifest decides a skip without the page,
+    but a call already running cannot be interrupted, so it is waited for
+    before returning: its stage and the link index file then land before the
+    run summary. Calls not yet started are cancelled.
+    The blocking requests and GCS calls run on a small thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='fetch-and-check')
+    calls = []
+
+    def run(function, *function_args):
+        call = loop.run_in_executor(executor, function, *function_args)
+        calls.append(call)
+        return call
+
+    def authenticate():
+        with metrics.stage('auth') as stage:
+            stage['ok'] = authentication(storage_context)
+        return stage['ok']
+
+    def read_manifest():
+        with metrics.stage('bucket_listing') as stage:
+            manifest = load_manifest(storage_context)
+            stage['rows'] = len(manifest['weeks'])
+        return manifest
+
+    def check_target_blob(blob_name):
+        with metrics.stage('blob_check') as stage:
+            exists = check_file_exists(storage_context, blob_name)
+            stage['rows'] = int(exists)
+        return exists
+
+    try:
+        page_fetch = run(get_link_index, session, metrics)
+        # Credentials have to be in place before any other bucket call
+        if not await run(authenticate):
+            print("Authentication failed. Exiting.")
+            return 'failed', None, None
+
+        manifest_load = run(read_manifest)
+        pending = {manifest_load, page_fetch}
+        blob_check = None
+        if report_date is not None and not args.recheck:
+            blob_check = run(check_target_blob, get_target_blob_name(report_date, args.output_format))
+            pending.add(blob_check)
+
+        manifest = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if blob_check in done and blob_check.result():
+                print("Latest file already in bucket. Skipping download.")
+                return 'skip', manifest, None
+            if manifest_load in done:
+                manifest = manifest_load.result()
+                if report_date is not None and not args.recheck and is_report_processed(manifest, report_date):
+                    print("Already have the latest file processed. Skipping download.")
+                    return 'skip', manifest, None
+            # A failed page fetch only matters once the week is known to need processing
+            if manifest is not None and page_fetch.done():
+                link_index = page_fetch.result()
+                if link_index is None:
+                    print("Failed to download Excel file. Exiting.")
+                    return 'failed', manifest, None
+                return 'process', manifest, link_index
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        await asyncio.gather(*calls, return_exceptions=True)
+
+def run_pipeline(args, metrics):
+    """
+    Check for a new report (or the backfill range) and process it.
+    Returns False if anything failed, True otherwise (including nothing to do).
+    """
+    if args.reprocess:
+        return run_reprocess(args, metrics)
+
+    session = create_http_session()
+    storage_context = StorageContext(GCP_BUCKET_NAME)
+
+    # Set up working directory first
+    work_dir = setup_working_directory()
+    print(f"Files will be processed in: {work_dir}")
+    content_cache = ContentCache(max_bytes=args.cache_size * 1024 * 1024) if args.cache_size else None
+
+    # Get the latest report date
+    report_date = None if args.backfill else get_latest_report_date()
+
+    if args.async_check:
+        decision, manifest, link_index = asyncio.run(
+            fetch_and_check_async(report_date, args, session, storage_context, metrics))
+    else:
+        decision, manifest, link_index = fetch_and_check(report_date, args, session, storage_context, metrics)
+    if decision != 'process':
+        return decision == 'skip'
+
+    if args.backfill:
+        return run_backfill(args.backfill[0], args.backfill[1], args, session, link_index, storage_context, manifest,
+                            metrics, content_cache)
+
+    previous_entry = manifest['weeks'].get(report_date.strftime('%Y-%m-%d'))
+    delta_base = get_delta_base(manifest, report_date) if args.delta else None
+    if args.delta and delta_base is None:
+        print("No previous week to build a delta against")
+    entry = process_report(report_date, args, session, link_index, storage_context, metrics, content_cache,
+                           previous_entry, delta_base)
+    if entry is None:
+        return False
+    if entry != previous_entry:
+        record_processed_week(manifest, report_date, entry)
+        with metrics.stage('manifest_save') as stage:
+            stage['ok'] = save_manifest(storage_context, manifest)
+        return stage['ok']
+    return True
+
+def check_only(args):
+    """
+    Decide whether there is work to do using only the date logic, the local
+    manifest mirror and a conditional GET of the statistics page. Neither the
+    transform libraries nor the GCS client are loaded, unless there is no
+    local manifest yet.
+    Returns the exit code: 0 if up to date (or the report is not published
+    yet), 1 if a new report is waiting to be processed, 2 if the check failed.
+    """
+    setup_working_directory()
+    report_date = get_latest_report_date()
+
+    manifest = load_json_cache(MANIFEST_FILE)
+    if 'weeks' not in manifest:
+        print(f"No local {MANIFEST_FILE}, loading the manifest from the bucket")
+        storage_context = StorageContext(GCP_BUCKET_NAME)
+        if not authentication(storage_context):
+            return 2
+        manifest = load_manifest(storage_context)
+    if is_report_processed(manifest, report_date):
+        print("Already have the latest file processed.")
+        return 0
+
+    try:
+        link_index = get_report_link_index(create_http_session(), BASE_URL)
+    except (requests.RequestException, CircuitOpenError) as e:
+        print(f"Error fetching statistics page: {e}")
+        return 2
+    if report_date.strftime('%y%m%d') not in link_index:
+        print(f"Report for {report_date.strftime('%Y-%m-%d')} not published yet.")
+        return 0
+    print(f"New report for {report_date.strftime('%Y-%m-%d')} is waiting to be processed.")
+    return 1
+
+def run_daemon(args, metrics_textfile=None):
+    """
+    Keep running instead of being started by cron. The HTTP session, storage
+    client, manifest and link index stay warm between checks. Once the latest
+    week is processed it sleeps until the next Monday release; until the new
+    file shows up it polls the statistics page every args.poll_interval minutes
+    with a conditional GET, so an unchanged page costs a 304.
+    With args.delta each new week also gets a delta against the week before.
+    Stops cleanly on SIGINT/SIGTERM.
+    """
+    stop = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: stop.set())
+
+    session = create_http_session()
+    storage_context = StorageContext(GCP_BUCKET_NAME)
+    work_dir = setup_working_directory()
+    print(f"Files will be processed in: {work_dir}")
+    content_cache = ContentCache(max_bytes=args.cache_size * 1024 * 1024) if args.cache_size else None
+    if not authentication(storage_context):
+        print("Authentication failed. Exiting.")
+        return
+
+    poll_seconds = args.poll_interval * 60
+    manifest = None
+    while not stop.is_set():
+        metrics = RunMetrics()
+        wait_seconds = poll_seconds
+        try:
+            report_date = get_latest_report_date()
+            week = report_date.strftime('%Y-%m-%d')
+            if manifest is None or week not in manifest['weeks']:
+                # Reloaded while a release is due, in case another run has processed it
+                with metrics.stage('bucket_listing') as stage:
+                    manifest = load_manifest(storage_context)
+                    stage['rows'] = len(manifest['weeks'])
+
+            if is_report_processed(manifest, report_date):
+                next_release = get_next_release_time(report_date)
+                wait_seconds = max((next_release - datetime.now()).total_seconds(), 0) or poll_seconds
+                print(f"Already have the latest file processed. Sleeping until {next_release}")
+            else:
+                link_index = get_link_index(session, metrics)
+                if link_index is not None and report_date.strftime('%y%m%d') not in link_index:
+                    print(f"Report for {week} not published yet, checking again in {args.poll_interval} minutes")
+                elif link_index is not None:
+                    delta_base = get_delta_base(manifest, report_date) if args.delta else None
+                    if args.delta and delta_base is None:
+                        print("No previous week to build a delta against")
+                    entry = process_report(report_date, args, session, link_index, storage_context, metrics,
+                                           content_cache, delta_base=delta_base)
+                    if entry is not None:
+                        record_processed_week(manifest, report_date, entry)
+                        with metrics.stage('manifest_save') as stage:
+                            stage['ok'] = save_manifest(storage_context, manifest)
+                        wait_seconds = 0
+        except Exception as e:
+            print(f"Error in scheduled check: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            if metrics.stages:
+                metrics.emit_summary()
+                if metrics_textfile:
+                    metrics.write_prometheus_textfile(metrics_textfile)
+        stop.wait(wait_seconds)
+    print("Stopping scheduler")
+
+def main(argv=None):
+    """
+    Main function with GCP bucket checking.
+    Returns the exit status: 0 on success, 1 if the run failed (check_only
+    has its own statuses).
+    """
+    args = parse_args(argv)
+    if args.check_only:
+        return check_only(args)
+    if args.check_reader_parity:
+        return 0 if check_reader_parity(args.check_reader_parity, args.reader, DISPENSER_SHEET) else 1
+
+    # Resolve output paths before the working directory changes
+    metrics_textfile = os.path.abspath(args.metrics_textfile) if args.metrics_textfile else None
+    profile_file = os.path.abspath(PROFILE_FILE)
+
+    if args.daemon:
+        run_daemon(args, metrics_textfile)
+        return 0
+
+    metrics = RunMetrics(trace_memory=args.profile)
+    profiler = None
+    if args.profile:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        ok = run_pipeline(args, metrics)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            print(f"Saved profile to {profile_file}")
+            for statistic in tracemalloc.take_snapshot().statistics('lineno')[:10]:
+                print(f"Allocated: {statistic}")
+            tracemalloc.stop()
+        metrics.emit_summary()
+        if metrics_textfile:
+            metrics.write_prometheus_textfile(metrics_textfile)
+    return 0 if ok else 1
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,392 @@
+# Primary libraries
+import argparse
+import base64
+import contextlib
+import http.server
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+# 3rd party libraries
+import google_crc32c
+import openpyxl
+from google.api_core.exceptions import NotFound
+
+import eps_noms_auto_main as pipeline
+
+REPORT_DATE = datetime(2024, 6, 7)
+SOURCE_FILENAME = pipeline.generate_filename(pipeline.BASE_FILENAME, REPORT_DATE)  # eps_nom_report-240607.xlsx
+
+# Column layout of the 'Dispenser Nominations' sheet before 'Week' is inserted (LPC is column H)
+DISPENSER_HEADER = [
+    'Dispenser Code',
+    'Dispenser Name',
+    'Address',
+    'Postcode',
+    'Region',
+    'ICB',
+    'Nominations',
+    'Local Pharmaceutical Committee (LPC) – where blank awaiting update or DAC',
+    'Dispenser Type',
+]
+REGIONS = ['East of England', 'London', 'Midlands', 'North East and Yorkshire', 'North West', 'South East', 'South West']
+SUMMARY_SHEETS = ['Contents', 'Regional Summary', 'GP Nominations']
+
+class InMemoryBlobWriter:
+    """
+    Stand-in for the writer returned by storage.Blob.open('wb'): the object
+    is only stored once close() finalises the upload.
+    """
+    def __init__(self, objects, name):
+        self._objects = objects
+        self._name = name
+        self._chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._objects[self._name] = b''.join(self._chunks)
+
+class InMemoryBlob:
+    """
+    Stand-in for storage.Blob covering the calls the pipeline makes.
+    """
+    def __init__(self, objects, name):
+        self._objects = objects
+        self.name = name
+        self.chunk_size = None
+        self.content_type = None
+        self.content_encoding = None
+
+    @property
+    def crc32c(self):
+        if self.name not in self._objects:
+            return None
+        return base64.b64encode(google_crc32c.Checksum(self._objects[self.name]).digest()).decode('utf-8')
+
+    def exists(self, **kwargs):
+        return self.name in self._objects
+
+    def open(self, mode='r', **kwargs):
+        if mode != 'wb':
+            raise ValueError(f"Only mode 'wb' is supported, not '{mode}'")
+        return InMemoryBlobWriter(self._objects, self.name)
+
+    def upload_from_filename(self, filename, **kwargs):
+        with open(filename, 'rb') as file:
+            self._objects[self.name] = file.read()
+
+    def upload_from_string(self, data, **kwargs):
+        self._objects[self.name] = data.encode('utf-8') if isinstance(data, str) else data
+
+    def download_as_bytes(self, **kwargs):
+        if self.name not in self._objects:
+            raise NotFound(f"{self.name} not found")
+        return self._objects[self.name]
+
+    def download_to_filename(self, filename, **kwargs):
+        with open(filename, 'wb') as file:
+            file.write(self.download_as_bytes())
+
+class InMemoryBucket:
+    """
+    Stand-in for storage.Bucket holding objects in a dict.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.objects = {}
+
+    def blob(self, blob_name):
+        return InMemoryBlob(self.objects, blob_name)
+
+    def get_blob(self, blob_name, **kwargs):
+        return self.blob(blob_name) if blob_name in self.objects else None
+
+    def list_blobs(self, prefix=None, **kwargs):
+        return [self.blob(name) for name in sorted(self.objects) if name.startswith(prefix or '')]
+
+class InMemoryStorageClient:
+    """
+    Stand-in for storage.Client, to inject into pipeline.StorageContext.
+    """
+    project = 'in-memory'
+
+    def __init__(self):
+        self._buckets = {}
+
+    def bucket(self, bucket_name):
+        return self._buckets.setdefault(bucket_name, InMemoryBucket(bucket_name))
+
+def generate_workbook(filename, row_count, seed=0):
+    """
+    Write a synthetic EPS nominations workbook with the real sheet layout.
+    """
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name in SUMMARY_SHEETS[:1]:
+        workbook.create_sheet(sheet_name).append(['Electronic Prescription Service nominations', REPORT_DATE.strftime('%d/%m/%Y')])
+
+    sheet = workbook.create_sheet(pipeline.DISPENSER_SHEET)
+    sheet.append(DISPENSER_HEADER)
+    lpcs = [f"Community Pharmacy Area {number}" for number in range(70)]
+    for number in range(row_count):
+        sheet.append([
+            f"F{chr(65 + number % 26)}{number:06d}",
+            f"Pharmacy {number}",
+            f"{rng.randint(1, 300)} High Street",
+            f"AB{rng.randint(1, 99)} {rng.randint(1, 9)}CD",
+            rng.choice(REGIONS),
+            f"NHS Integrated Care Board {rng.randint(1, 42)}",
+            rng.randint(0, 12000),
+            rng.choice(lpcs) if rng.random() > 0.01 else None,
+            'Community Pharmacy',
+        ])
+
+    for sheet_name in SUMMARY_SHEETS[1:]:
+        summary = workbook.create_sheet(sheet_name)
+        summary.append(['Region', 'Nominations'])
+        for region in REGIONS:
+            summary.append([region, rng.randint(0, 10 ** 7)])
+    workbook.save(filename)
+
+class ReportStubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves a statistics page linking to the synthetic report, and the report itself.
+    """
+    protocol_version = 'HTTP/1.1'
+    report_path = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/statistics':
+            body = f'<html><body><a href="/files/{SOURCE_FILENAME}">Nominations report</a></body></html>'.encode('utf-8')
+            content_type = 'text/html'
+        elif self.path == f'/files/{SOURCE_FILENAME}':
+            with open(self.report_path, 'rb') as file:
+                body = file.read()
+            content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_report_stub(report_path):
+    """
+    Start the local HTTP stub in a background thread. Returns (server, statistics page url).
+    """
+    handler = type('Handler', (ReportStubHandler,), {'report_path': report_path})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/statistics"
+
+def get_stages(page_url, report_path, csv_path, readers):
+    """
+    Benchmark stages as (name, setup, stage, bytes_in) tuples.
+    setup runs untimed before stage and its result is passed to stage.
+    """
+    def download(_):
+        target = os.path.join(tempfile.mkdtemp(), SOURCE_FILENAME)
+        return pipeline.download_excel(page_url, target)
+
+    def modified_workbook():
+        return pipeline.modify_excel(report_path)
+
+    def upload(_):
+        storage_context = pipeline.StorageContext(pipeline.GCP_BUCKET_NAME, client=InMemoryStorageClient())
+        return pipeline.upload_to_gcp(storage_context, csv_path, f"{pipeline.BLOB_PREFIX}benchmark.csv",
+                                      parallel_threshold=float('inf'))
+
+    report_size = os.path.getsize(report_path)
+    stages = [
+        ('download_excel', lambda: None, download, report_size),
+        ('modify_excel', lambda: None, lambda _: pipeline.modify_excel(report_path) is not None, report_size),
+        ('save_excel', modified_workbook,
+         lambda workbook: pipeline.save_excel(workbook, os.path.join(tempfile.mkdtemp(), 'modified.xlsx')), report_size),
+        ('excel_to_csv', modified_workbook,
+         lambda workbook: pipeline.excel_to_csv(workbook, os.path.join(tempfile.mkdtemp(), 'legacy.csv')), report_size),
+    ]
+    for reader in readers:
+        stages.append((
+            f"export_dispenser_rows[{reader}]", lambda: None,
+            lambda _, reader=reader: pipeline.export_dispenser_rows(
+                report_path, csv_filename=os.path.join(tempfile.mkdtemp(), 'stream.csv'), reader=reader) is not None,
+            report_size,
+        ))
+    stages.append(('load_dispenser_frame', lambda: None,
+                   lambda _: len(pipeline.load_dispenser_frame(report_path)[0]) > 0, report_size))
+    stages.append(('upload_to_gcp', lambda: None, upload, os.path.getsize(csv_path)))
+    return stages
+
+def measure_stage(setup, stage, trace_memory):
+    """
+    Run one stage and measure wall time and memory.
+    Pipeline output is silenced so it doesn't skew timings.
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        prepared = setup()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        ok = stage(prepared)
+        seconds = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    # ru_maxrss is in KiB on Linux
+    return {
+        'ok': bool(ok),
+        'seconds': seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_traced_mb': traced_peak / (1024 * 1024) if traced_peak is not None else None,
+    }
+
+def _measure_in_child(connection, setup, stage, trace_memory):
+    try:
+        connection.send(measure_stage(setup, stage, trace_memory))
+    except Exception as e:
+        connection.send({'ok': False, 'error': repr(e)})
+    finally:
+        connection.close()
+
+def run_stage(setup, stage, trace_memory):
+    """
+    Run a stage in a forked child process so peak RSS belongs to that stage alone.
+    Falls back to running in-process where fork is not available.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return measure_stage(setup, stage, trace_memory)
+    context = multiprocessing.get_context('fork')
+    parent_connection, child_connection = context.Pipe(duplex=False)
+    process = context.Process(target=_measure_in_child, args=(child_connection, setup, stage, trace_memory))
+    process.start()
+    child_connection.close()
+    result = parent_connection.recv()
+    process.join()
+    return result
+
+def get_version():
+    """
+    Git commit of the pipeline being benchmarked, if available.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(row_counts, readers, trace_memory=False):
+    """
+    Benchmark every stage for each workbook size. Returns the results document.
+    """
+    results = []
+    for row_count in row_counts:
+        work_dir = tempfile.mkdtemp(prefix=f"eps_noms_benchmark_{row_count}_")
+        report_path = os.path.join(work_dir, SOURCE_FILENAME)
+        csv_path = os.path.join(work_dir, SOURCE_FILENAME.replace('-', '+').replace('.xlsx', '.csv'))
+
+        print(f"\nGenerating synthetic workbook with {row_count} rows")
+        generate_workbook(report_path, row_count)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            pipeline.export_dispenser_rows(report_path, csv_filename=csv_path)
+
+        server, page_url = start_report_stub(report_path)
+        previous_dir = os.getcwd()
+        os.chdir(work_dir)  # Download caches are written to the working directory
+        try:
+            for name, setup, stage, bytes_in in get_stages(page_url, report_path, csv_path, readers):
+                result = run_stage(setup, stage, trace_memory)
+                result.update({'stage': name, 'rows': row_count, 'bytes_in': bytes_in})
+                if result.get('seconds'):
+                    result['rows_per_second'] = row_count / result['seconds']
+                    result['mb_per_second'] = bytes_in / (1024 * 1024) / result['seconds']
+                results.append(result)
+                if result['ok']:
+                    print(f"{name:36} {row_count:>9} rows {result['seconds']:9.3f}s "
+                          f"{result['peak_rss_mb']:9.1f} MB RSS {result['rows_per_second']:12.0f} rows/s")
+                else:
+                    print(f"{name:36} {row_count:>9} rows FAILED {result.get('error', '')}")
+        finally:
+            os.chdir(previous_dir)
+            server.shutdown()
+
+    return {
+        'version': get_version(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+def compare_results(baseline, current, tolerance):
+    """
+    Report stages that got slower or used more memory than the baseline by more than tolerance.
+    Returns the number of regressions.
+    """
+    baseline_results = {(result['stage'], result['rows']): result for result in baseline['results'] if result['ok']}
+    regressions = 0
+    for result in current['results']:
+        previous = baseline_results.get((result['stage'], result['rows']))
+        if previous is None or not result['ok']:
+            continue
+        for metric in ('seconds', 'peak_rss_mb'):
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions += 1
+                print(f"Regression: {result['stage']} ({result['rows']} rows) {metric} "
+                      f"{previous[metric]:.3f} -> {result[metric]:.3f}")
+    print(f"Compared against {baseline.get('version') or 'baseline'}: {regressions} regressions")
+    return regressions
+
+def main(argv=None):
+    """
+    Benchmark the pipeline stages on synthetic workbooks.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the EPS nominations pipeline on synthetic workbooks.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                        help="Dispenser Nominations row counts to benchmark")
+    parser.add_argument('--readers', nargs='+', choices=tuple(pipeline.WORKBOOK_READERS), default=['openpyxl', 'xml'],
+                        help="Reader backends to benchmark the streaming export with")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Also record peak Python allocations with tracemalloc (slows stages down)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the JSON results")
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help="Flag regressions against an earlier results file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown/memory growth before a stage counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.rows, args.readers, args.trace_memory)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"\nSaved benchmark results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if compare_results(baseline, results, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
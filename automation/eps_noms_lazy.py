@@ -0,0 +1,17 @@
+# Primary libraries
+import importlib
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that is only imported the first time one of
+    its attributes is used, so runs that stop early (--check-only, or nothing
+    new to process) never load openpyxl, pandas, pyarrow or the GCS client.
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        value = getattr(importlib.import_module(self._name), attribute)
+        # Later lookups are plain attribute reads
+        setattr(self, attribute, value)
+        return value
@@ -0,0 +1,333 @@
+# Primary libraries
+import threading
+import zipfile
+from datetime import date, datetime
+from itertools import zip_longest
+from xml.etree import ElementTree
+
+# 3rd party libraries
+from eps_noms_lazy import LazyModule
+
+openpyxl = LazyModule('openpyxl')
+openpyxl_datetime = LazyModule('openpyxl.utils.datetime')
+openpyxl_numbers = LazyModule('openpyxl.styles.numbers')
+openpyxl_translate = LazyModule('openpyxl.formula.translate')
+
+# Config
+# xlsx XML namespaces
+SHEET_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+DOC_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+ROW_TAG = f'{{{SHEET_MAIN_NS}}}row'
+CELL_TAG = f'{{{SHEET_MAIN_NS}}}c'
+VALUE_TAG = f'{{{SHEET_MAIN_NS}}}v'
+FORMULA_TAG = f'{{{SHEET_MAIN_NS}}}f'
+INLINE_STRING_TAG = f'{{{SHEET_MAIN_NS}}}is'
+TEXT_TAG = f'{{{SHEET_MAIN_NS}}}t'
+RUN_TAG = f'{{{SHEET_MAIN_NS}}}r'
+SHARED_STRING_TAG = f'{{{SHEET_MAIN_NS}}}si'
+SHEET_DATA_TAG = f'{{{SHEET_MAIN_NS}}}sheetData'
+DIMENSION_TAG = f'{{{SHEET_MAIN_NS}}}dimension'
+SHEET_TAG = f'{{{SHEET_MAIN_NS}}}sheet'
+WORKBOOK_PROPERTIES_TAG = f'{{{SHEET_MAIN_NS}}}workbookPr'
+NUMBER_FORMAT_TAG = f'{{{SHEET_MAIN_NS}}}numFmt'
+CELL_FORMATS_TAG = f'{{{SHEET_MAIN_NS}}}cellXfs'
+CELL_FORMAT_TAG = f'{{{SHEET_MAIN_NS}}}xf'
+RELATIONSHIP_TAG = f'{{{PKG_REL_NS}}}Relationship'
+RELATIONSHIP_ID_ATTRIBUTE = f'{{{DOC_REL_NS}}}id'
+
+class WorkbookReader:
+    """
+    Base for the xlsx reader backends in WORKBOOK_READERS. Each provides
+    sheet_names, iter_rows(sheet_name) yielding one tuple of values per row
+    (padded from column A, as openpyxl does) and close(), and can be used
+    as a context manager.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class OpenpyxlReader(WorkbookReader):
+    """
+    Workbook reader backed by openpyxl in read-only mode.
+    """
+    def __init__(self, filename):
+        self._workbook = openpyxl.load_workbook(filename, read_only=True)
+
+    @property
+    def sheet_names(self):
+        return self._workbook.sheetnames
+
+    def iter_rows(self, sheet_name):
+        return self._workbook[sheet_name].iter_rows(values_only=True)
+
+    def close(self):
+        self._workbook.close()
+
+def get_column_index(coordinate):
+    """
+    Column number for a cell reference, e.g. 'C12' -> 3.
+    """
+    index = 0
+    for char in coordinate:
+        if char.isdigit():
+            break
+        index = index * 26 + ord(char) - 64
+    return index
+
+def get_text_content(element):
+    """
+    Text of a shared/inline string element, ignoring rich text formatting
+    (same as openpyxl's Text.content).
+    """
+    snippets = []
+    plain = element.findtext(TEXT_TAG)
+    if plain is not None:
+        snippets.append(plain)
+    for run in element.findall(RUN_TAG):
+        text = run.findtext(TEXT_TAG)
+        if text is not None:
+            snippets.append(text)
+    return ''.join(snippets)
+
+class XmlReader(WorkbookReader):
+    """
+    Workbook reader that streams xl/worksheets/sheetN.xml and the shared
+    strings table straight from the xlsx zip with iterparse, skipping
+    openpyxl's cell objects. Values and row padding match OpenpyxlReader.
+    """
+    def __init__(self, filename):
+        self._zip = zipfile.ZipFile(filename)
+        workbook = ElementTree.fromstring(self._zip.read('xl/workbook.xml'))
+        relationships = ElementTree.fromstring(self._zip.read('xl/_rels/workbook.xml.rels'))
+
+        targets = {}
+        self._shared_strings_path = 'xl/sharedStrings.xml'
+        for relationship in relationships.iter(RELATIONSHIP_TAG):
+            target = relationship.get('Target')
+            target = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+            targets[relationship.get('Id')] = target
+            if relationship.get('Type', '').endswith('/sharedStrings'):
+                self._shared_strings_path = target
+
+        self._sheet_paths = {
+            sheet.get('name'): targets[sheet.get(RELATIONSHIP_ID_ATTRIBUTE)]
+            for sheet in workbook.iter(SHEET_TAG)
+        }
+        properties = workbook.find(WORKBOOK_PROPERTIES_TAG)
+        date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+        self._epoch = openpyxl_datetime.MAC_EPOCH if date1904 else openpyxl_datetime.WINDOWS_EPOCH
+        self._shared_strings = None
+        self._date_styles = None
+        self._timedelta_styles = None
+        # Sheets may be read from several threads, the shared tables are loaded once
+        self._lock = threading.Lock()
+
+    @property
+    def sheet_names(self):
+        return list(self._sheet_paths)
+
+    def _load_shared_strings(self):
+        self._shared_strings = []
+        if self._shared_strings_path not in self._zip.namelist():
+            return
+        with self._zip.open(self._shared_strings_path) as source:
+            for _, element in ElementTree.iterparse(source):
+                if element.tag == SHARED_STRING_TAG:
+                    self._shared_strings.append(get_text_content(element).replace('x005F_', ''))
+                    element.clear()
+
+    def _load_styles(self):
+        self._date_styles = set()
+        self._timedelta_styles = set()
+        if 'xl/styles.xml' not in self._zip.namelist():
+            return
+        styles = ElementTree.fromstring(self._zip.read('xl/styles.xml'))
+        custom_formats = {
+            int(number_format.get('numFmtId')): number_format.get('formatCode')
+            for number_format in styles.iter(NUMBER_FORMAT_TAG)
+        }
+        cell_formats = styles.find(CELL_FORMATS_TAG)
+        if cell_formats is None:
+            return
+        for style_id, cell_format in enumerate(cell_formats.findall(CELL_FORMAT_TAG)):
+            format_id = int(cell_format.get('numFmtId', 0))
+            number_format = custom_formats.get(format_id, openpyxl_numbers.BUILTIN_FORMATS.get(format_id))
+            if openpyxl_numbers.is_date_format(number_format):
+                self._date_styles.add(style_id)
+            if openpyxl_numbers.is_timedelta_format(number_format):
+                self._timedelta_styles.add(style_id)
+
+    def _cell_value(self, cell, coordinate, shared_formulae):
+        data_type = cell.get('t', 'n')
+
+        formula = cell.find(FORMULA_TAG)
+        if formula is not None:
+            value = f"={formula.text or ''}"
+            if formula.get('t') == 'shared':
+                shared_id = formula.get('si')
+                if shared_id in shared_formulae:
+                    value = shared_formulae[shared_id].translate_formula(coordinate)
+                elif value != '=':
+                    shared_formulae[shared_id] = openpyxl_translate.Translator(value, coordinate)
+            return value
+
+        if data_type == 'inlineStr':
+            inline_string = cell.find(INLINE_STRING_TAG)
+            return get_text_content(inline_string) if inline_string is not None else None
+
+        value = cell.findtext(VALUE_TAG) or None
+        if value is None:
+            return None
+        if data_type == 'n':
+            value = float(value) if ('.' in value or 'E' in value or 'e' in value) else int(value)
+            style_id = int(cell.get('s') or 0)
+            if style_id in self._date_styles:
+                try:
+                    return openpyxl_datetime.from_excel(value, self._epoch,
+                                                        timedelta=style_id in self._timedelta_styles)
+                except (OverflowError, ValueError):
+                    return '#VALUE!'
+            return value
+        if data_type == 's':
+            return self._shared_strings[int(value)]
+        if data_type == 'b':
+            return bool(int(value))
+        if data_type == 'd':
+            return openpyxl_datetime.from_ISO8601(value)
+        return value  # 'str' and 'e' are plain text
+
+    def iter_rows(self, sheet_name):
+        with self._lock:
+            if self._shared_strings is None:
+                self._load_shared_strings()
+            if self._date_styles is None:
+                self._load_styles()
+
+        max_row = None
+        max_column = None
+        expected_row = 1
+        shared_formulae = {}
+        sheet_data = None
+        with self._zip.open(self._sheet_paths[sheet_name]) as source:
+            for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == SHEET_DATA_TAG:
+                        sheet_data = element
+                    continue
+
+                if element.tag == DIMENSION_TAG:
+                    # e.g. ref="A1:J2000", pad rows to J and stop after row 2000 like openpyxl
+                    last_cell = element.get('ref', '').split(':')[-1]
+                    if last_cell:
+                        max_column = get_column_index(last_cell)
+                        max_row = int(last_cell[len(last_cell.rstrip('0123456789')):])
+                elif element.tag == ROW_TAG:
+                    row_number = int(element.get('r', expected_row))
+                    if max_row is not None and row_number > max_row:
+                        break
+                    if row_number >= expected_row:
+                        while expected_row < row_number:
+                            yield (None,) * (max_column or 0)
+                            expected_row += 1
+
+                        values = {}
+                        column = 0
+                        for cell in element.iter(CELL_TAG):
+                            coordinate = cell.get('r')
+                            column = get_column_index(coordinate) if coordinate else column + 1
+                            values[column] = self._cell_value(cell, coordinate, shared_formulae)
+                        width = max_column or max(values, default=0)
+                        yield tuple(values.get(column) for column in range(1, width + 1))
+                        expected_row = row_number + 1
+
+                    # Drop parsed rows so memory stays flat
+                    element.clear()
+                    if sheet_data is not None:
+                        sheet_data.remove(element)
+
+    def close(self):
+        self._zip.close()
+
+class CalamineReader(WorkbookReader):
+    """
+    Workbook reader backed by the python-calamine (Rust) binding, if installed.
+    Whole numbers and dates are converted to match openpyxl, but formula
+    cells give their cached value rather than the formula.
+    """
+    def __init__(self, filename):
+        from python_calamine import CalamineWorkbook
+        self._workbook = CalamineWorkbook.from_path(filename)
+
+    @property
+    def sheet_names(self):
+        return self._workbook.sheet_names
+
+    def iter_rows(self, sheet_name):
+        sheet = self._workbook.get_sheet_by_name(sheet_name)
+        # calamine ranges start at the first used cell, openpyxl rows start at A1
+        first_row, first_column = sheet.start or (0, 0)
+        for _ in range(first_row):
+            yield (None,) * (first_column + sheet.width)
+        for row in sheet.iter_rows():
+            yield (None,) * first_column + tuple(self._to_openpyxl_value(value) for value in row)
+
+    @staticmethod
+    def _to_openpyxl_value(value):
+        if value == '':
+            return None
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, date) and not isinstance(value, datetime):
+            return datetime(value.year, value.month, value.day)
+        return value
+
+    def close(self):
+        self._workbook.close()
+
+WORKBOOK_READERS = {
+    'openpyxl': OpenpyxlReader,
+    'xml': XmlReader,
+    'calamine': CalamineReader,
+}
+
+def open_workbook_reader(filename, backend='openpyxl'):
+    """
+    Open a workbook with the configured reader backend.
+    """
+    if backend not in WORKBOOK_READERS:
+        raise ValueError(f"Unknown workbook reader '{backend}', expected one of {', '.join(WORKBOOK_READERS)}")
+    return WORKBOOK_READERS[backend](filename)
+
+def check_reader_parity(filename, backend, sheet_name):
+    """
+    Compare the rows a reader backend gives for a sheet against openpyxl.
+    Trailing empty cells and rows are ignored.
+    """
+    def trimmed_rows(reader):
+        rows = []
+        for row in reader.iter_rows(sheet_name):
+            row = list(row)
+            while row and row[-1] is None:
+                row.pop()
+            rows.append(row)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    with open_workbook_reader(filename, 'openpyxl') as expected_reader:
+        expected_rows = trimmed_rows(expected_reader)
+    with open_workbook_reader(filename, backend) as actual_reader:
+        actual_rows = trimmed_rows(actual_reader)
+
+    mismatches = 0
+    for row_number, (expected, actual) in enumerate(zip_longest(expected_rows, actual_rows), start=1):
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"Row {row_number} differs:\n  openpyxl: {expected}\n  {backend}: {actual}")
+    print(f"Reader parity for '{sheet_name}' ({backend} vs openpyxl): "
+          f"{len(expected_rows)} rows, {mismatches} mismatched")
+    return mismatches == 0
@@ -0,0 +1,424 @@
+# Primary libraries
+import base64
+import contextlib
+import gzip
+import hashlib
+import io
+import os
+import re
+import threading
+from datetime import datetime
+
+# 3rd party libraries
+from eps_noms_lazy import LazyModule
+from eps_noms_transport import BIGQUERY_HOST, GCS_HOST, GCS_TIMEOUT, transport
+
+bigquery = LazyModule('google.cloud.bigquery')
+google_crc32c = LazyModule('google_crc32c')
+pa = LazyModule('pyarrow')
+pq = LazyModule('pyarrow.parquet')
+transfer_manager = LazyModule('google.cloud.storage.transfer_manager')
+
+# Config
+PARQUET_BATCH_SIZE = 10000
+PARQUET_COMPRESSION = 'zstd'
+# Text columns with few distinct values, dictionary encoded in Parquet
+PARQUET_DICTIONARY_KEYWORDS = ('lpc', 'local pharmaceutical committee', 'ods', 'dispenser code', 'region')
+
+FILE_CHUNK_SIZE = 1024 * 1024  # Bytes read from a local file at a time
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Must be a multiple of 256 KiB
+PARALLEL_UPLOAD_THRESHOLD = 64 * 1024 * 1024
+PARALLEL_UPLOAD_WORKERS = 8
+
+BIGQUERY_JOB_TIMEOUT = 600  # Seconds to wait for a load job
+BIGQUERY_PARTITION_COLUMN = 'Week'
+BIGQUERY_COLUMN_NAME_LENGTH = 300
+
+def get_column_names(header):
+    """
+    Unique, non-empty column names for a header row (needed for Parquet).
+    """
+    names = []
+    for position, value in enumerate(header, start=1):
+        name = str(value).strip() if value is not None else f"column_{position}"
+        while name in names:
+            name = f"{name}_{position}"
+        names.append(name)
+    return names
+
+def infer_arrow_type(column_name, values):
+    """
+    Pick an Arrow type for a column from a sample of its values.
+    """
+    if column_name == 'Week':
+        return pa.date32()
+    present = [value for value in values if value is not None]
+    if not present:
+        return pa.string()
+    if all(isinstance(value, bool) for value in present):
+        return pa.bool_()
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return pa.int64()
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return pa.float64()
+    if all(isinstance(value, datetime) for value in present):
+        return pa.timestamp('us')
+    return pa.string()
+
+def to_arrow_array(values, arrow_type):
+    """
+    Convert a column of sheet values to an Arrow array of the given type.
+    """
+    if arrow_type == pa.date32():
+        values = [datetime.strptime(value, '%Y-%m-%d').date() if isinstance(value, str) else value
+                  for value in values]
+    elif arrow_type == pa.string():
+        values = [str(value) if value is not None else None for value in values]
+    return pa.array(values, type=arrow_type)
+
+def get_dictionary_columns(schema):
+    """
+    Names of the text columns (LPC, ODS code, region) to dictionary encode in Parquet.
+    """
+    return [
+        field.name for field in schema
+        if field.type == pa.string() and any(keyword in field.name.lower() for keyword in PARQUET_DICTIONARY_KEYWORDS)
+    ]
+
+class ParquetRowWriter:
+    """
+    Write sheet rows to a typed, compressed Parquet file in batches.
+    Columns given in types (position -> Arrow type) always get that type, so
+    the schema is the same every week; the others are inferred from the first
+    batch. 'Week' is stored as a date and LPC, ODS code and region columns are
+    dictionary encoded. If key_index is given, rows with no value in that
+    column (the notes below the data) are left out.
+    """
+    def __init__(self, filename, header, types=None, key_index=None):
+        self.filename = filename
+        self.column_names = get_column_names(header)
+        self.types = types or {}
+        self.key_index = key_index
+        self.schema = None
+        self.row_count = 0
+        self._rows = []
+        self._writer = None
+
+    def write_row(self, row):
+        if self.key_index is not None and (len(row) <= self.key_index or row[self.key_index] is None):
+            return
+        row = list(row[:len(self.column_names)])
+        row.extend([None] * (len(self.column_names) - len(row)))
+        self._rows.append(row)
+        if len(self._rows) >= PARQUET_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        columns = list(zip(*self._rows)) if self._rows else [()] * len(self.column_names)
+        if self.schema is None:
+            self.schema = pa.schema([
+                pa.field(name, self.types.get(position) or infer_arrow_type(name, values))
+                for position, (name, values) in enumerate(zip(self.column_names, columns))
+            ])
+            self._writer = pq.ParquetWriter(
+                self.filename, self.schema, compression=PARQUET_COMPRESSION,
+                use_dictionary=get_dictionary_columns(self.schema) or False)
+
+        arrays = []
+        for field, values in zip(self.schema, columns):
+            try:
+                arrays.append(to_arrow_array(values, field.type))
+            except (pa.ArrowException, TypeError, ValueError) as e:
+                raise ValueError(f"Column '{field.name}' does not match type {field.type}: {e}")
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self.row_count += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        if self._rows or self._writer is None:
+            self._flush()
+        self._writer.close()
+
+def file_crc32c(filename):
+    """
+    CRC32C of a local file, base64 encoded the same way as blob.crc32c.
+    """
+    checksum = google_crc32c.Checksum()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(FILE_CHUNK_SIZE), b''):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode('utf-8')
+
+class Crc32cWriter:
+    """
+    Write-only file object that keeps nothing but the CRC32C of what is written to it.
+    """
+    def __init__(self):
+        self._checksum = google_crc32c.Checksum()
+
+    def write(self, data):
+        self._checksum.update(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def b64digest(self):
+        return base64.b64encode(self._checksum.digest()).decode('utf-8')
+
+def cancel_blob_writer(writer):
+    """
+    Abandon the upload behind a writer from blob.open('wb') without committing it.
+    BlobWriter.close(), which also runs when the writer is garbage collected,
+    finalises the upload with whatever has been sent so far, so the writer's
+    buffer is closed first (close() then has nothing to finalise) and the
+    resumable session, if one was started, is cancelled.
+    """
+    buffer = getattr(writer, '_buffer', None)
+    if buffer is not None:
+        buffer.close()
+    upload_and_transport = getattr(writer, '_upload_and_transport', None)
+    if upload_and_transport:
+        upload, session = upload_and_transport
+        if upload.resumable_url and not upload.finished:
+            try:
+                # GCS answers 499 once the session is cancelled
+                session.request('DELETE', upload.resumable_url, timeout=GCS_TIMEOUT)
+            except Exception as e:
+                # An unfinished session is discarded by GCS after a week anyway
+                print(f"Error cancelling resumable upload: {e}")
+
+def write_gzip(source_file_name, target):
+    """
+    Compress a file in chunks into a writable file object.
+    mtime and the file name in the header are fixed, so identical input always
+    gives an identical (same crc32c) output.
+    """
+    with open(source_file_name, 'rb') as source, gzip.GzipFile(
+            filename=os.path.basename(source_file_name), fileobj=target, mode='wb', mtime=0) as compressed:
+        for chunk in iter(lambda: source.read(FILE_CHUNK_SIZE), b''):
+            compressed.write(chunk)
+
+def upload_to_gcp(storage_context, source_file_name, destination_blob_name, compress=False,
+                  chunk_size=UPLOAD_CHUNK_SIZE, parallel_threshold=PARALLEL_UPLOAD_THRESHOLD,
+                  content_type='text/csv'):
+    """
+    Upload file to GCP bucket.
+    - Skipped if an object with the same crc32c already exists
+    - compress stores it gzip encoded (GCS decompresses it for readers that don't accept gzip),
+      compressed on the fly into a resumable upload without a local .gz copy
+    - Resumable upload in chunk_size chunks, or parallel chunks above parallel_threshold
+    """
+    try:
+        if compress:
+            # The skip check needs the crc32c of the gzip bytes, so compress into a checksum first
+            crc32c_writer = Crc32cWriter()
+            write_gzip(source_file_name, crc32c_writer)
+            crc32c = crc32c_writer.b64digest()
+        else:
+            crc32c = file_crc32c(source_file_name)
+
+        existing_blob = transport.call(GCS_HOST, storage_context.bucket.get_blob, destination_blob_name,
+                                       timeout=GCS_TIMEOUT, retry=None)
+        if existing_blob is not None and existing_blob.crc32c == crc32c:
+            print(f"File {destination_blob_name} unchanged in bucket {storage_context.bucket_name} (crc32c {crc32c}). Skipping upload.")
+            return True
+
+        blob = storage_context.blob(destination_blob_name)
+        blob.content_type = content_type
+        if compress:
+            blob.content_encoding = 'gzip'
+
+            def upload_compressed():
+                # A failed attempt is cancelled, so nothing is committed and the transport starts again
+                upload = blob.open('wb', chunk_size=chunk_size, ignore_flush=True, content_type=content_type,
+                                   checksum='crc32c', timeout=GCS_TIMEOUT, retry=None)
+                try:
+                    write_gzip(source_file_name, upload)
+                    upload.close()
+                except BaseException:
+                    cancel_blob_writer(upload)
+                    raise
+
+            transport.call(GCS_HOST, upload_compressed)
+        elif os.path.getsize(source_file_name) >= parallel_threshold:
+            # Threads rather than processes, uploads are I/O bound and may already run in a backfill pool
+            transport.call(
+                GCS_HOST, transfer_manager.upload_chunks_concurrently,
+                source_file_name, blob, content_type=content_type, chunk_size=chunk_size,
+                worker_type=transfer_manager.THREAD, max_workers=PARALLEL_UPLOAD_WORKERS, checksum='crc32c',
+                timeout=GCS_TIMEOUT, retry=None)
+        else:
+            blob.chunk_size = chunk_size
+            transport.call(GCS_HOST, blob.upload_from_filename, source_file_name, checksum='crc32c',
+                           timeout=GCS_TIMEOUT, retry=None)
+        print(f"File {source_file_name} uploaded to {destination_blob_name} in bucket {storage_context.bucket_name}")
+        return True
+    except Exception as e:
+        print(f"Error uploading to GCP: {e}")
+        return False
+
+class UploadStream:
+    """
+    Write-only file object feeding a resumable upload, hashing the bytes
+    (before any gzip) as they go. The object only appears in the bucket once
+    close() finalises the upload; abort() cancels it so a failed run never
+    leaves a partial object behind.
+    """
+    def __init__(self, storage_context, destination_blob_name, content_type='text/csv', compress=False,
+                 chunk_size=UPLOAD_CHUNK_SIZE):
+        blob = storage_context.blob(destination_blob_name)
+        if compress:
+            blob.content_encoding = 'gzip'
+        self.blob_name = destination_blob_name
+        self.bytes_written = 0
+        self.closed = False
+        self._committed = False
+        self._digest = hashlib.sha256()
+        self._upload = blob.open('wb', chunk_size=chunk_size, ignore_flush=True, content_type=content_type)
+        self._compressor = gzip.GzipFile(fileobj=self._upload, mode='wb', mtime=0) if compress else None
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError(f"Upload stream for {self.blob_name} is closed")
+        self._digest.update(data)
+        self.bytes_written += len(data)
+        (self._compressor or self._upload).write(data)
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._compressor is not None:
+            self._compressor.close()
+        self._upload.close()
+        self._committed = True
+
+    def abort(self):
+        self.closed = True
+        if self._committed:
+            return
+        cancel_blob_writer(self._upload)
+        if self._compressor is not None:
+            # Only marks it closed, its trailer can no longer reach the cancelled upload
+            with contextlib.suppress(ValueError):
+                self._compressor.close()
+
+class BigQueryContext:
+    """
+    BigQuery client and destination table (project.dataset.table) for the
+    Dispenser Nominations rows, shared by every week loaded in a run.
+    Pass a client to load into a local stand-in or an emulator instead.
+    """
+    def __init__(self, table_id, client=None):
+        self.table_id = table_id
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = bigquery.Client()
+            return self._client
+
+def get_bigquery_column_names(header):
+    """
+    Column names for a header row that BigQuery accepts: letters, digits and
+    underscores, not starting with a digit, and unique ignoring case.
+    """
+    names = []
+    for name in get_column_names(header):
+        name = re.sub(r'[^0-9A-Za-z_]+', '_', name).strip('_') or 'column'
+        if name[0].isdigit():
+            name = f"_{name}"
+        name = name[:BIGQUERY_COLUMN_NAME_LENGTH]
+        unique_name = name
+        suffix = 1
+        while unique_name.lower() in (existing.lower() for existing in names):
+            suffix += 1
+            unique_name = f"{name[:BIGQUERY_COLUMN_NAME_LENGTH - len(str(suffix)) - 1]}_{suffix}"
+        names.append(unique_name)
+    return names
+
+class BigQueryRowWriter:
+    """
+    Collect the transformed rows for one week as Parquet in memory, then load
+    them into a table partitioned on 'Week' with a single load job that
+    replaces that week's partition, so reruns and republished weeks never
+    duplicate rows. Rows without a Week (the notes below the data) are left out.
+    open() takes the header row and optional Arrow types by position, as ParquetRowWriter does.
+    """
+    def __init__(self, bigquery_context, week):
+        self.bigquery_context = bigquery_context
+        self.week = week
+        self.column_names = None
+        self._week_index = None
+        self._buffer = io.BytesIO()
+        self._parquet_writer = None
+
+    @property
+    def row_count(self):
+        return self._parquet_writer.row_count if self._parquet_writer is not None else 0
+
+    @property
+    def bytes_written(self):
+        return self._buffer.getbuffer().nbytes
+
+    def open(self, header, types=None):
+        self.column_names = get_bigquery_column_names(header)
+        if BIGQUERY_PARTITION_COLUMN not in self.column_names:
+            raise ValueError(f"No '{BIGQUERY_PARTITION_COLUMN}' column to partition the BigQuery table on")
+        self._week_index = self.column_names.index(BIGQUERY_PARTITION_COLUMN)
+        self._parquet_writer = ParquetRowWriter(pa.PythonFile(self._buffer, mode='w'), self.column_names,
+                                                types, key_index=self._week_index)
+
+    def write_row(self, row):
+        self._parquet_writer.write_row(row)
+
+    def close(self):
+        self._parquet_writer.close()
+
+    def load(self):
+        """
+        Run the load job into the week's partition.
+        Returns the number of rows loaded, or None on failure.
+        """
+        partition = f"{self.bigquery_context.table_id}${self.week.replace('-', '')}"
+        try:
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.PARQUET,
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                time_partitioning=bigquery.TimePartitioning(
+                    type_=bigquery.TimePartitioningType.DAY, field=BIGQUERY_PARTITION_COLUMN),
+                # Columns NHS adds later are added to the table instead of failing the load
+                schema_update_options=[
+                    bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION,
+                    bigquery.SchemaUpdateOption.ALLOW_FIELD_RELAXATION,
+                ],
+            )
+
+            def run_load_job():
+                # Safe to retry, the load replaces the whole partition
+                self._buffer.seek(0)
+                job = self.bigquery_context.client.load_table_from_file(self._buffer, partition, job_config=job_config)
+                job.result(timeout=BIGQUERY_JOB_TIMEOUT)
+                return job
+
+            job = transport.call(BIGQUERY_HOST, run_load_job)
+            print(f"Loaded {job.output_rows} rows into {partition}")
+            return job.output_rows
+        except Exception as e:
+            print(f"Error loading rows into BigQuery: {e}")
+            print(f"Partition: {partition}")
+            return None
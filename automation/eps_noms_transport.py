@@ -0,0 +1,150 @@
+# Primary libraries
+import random
+import threading
+import time
+
+# 3rd party libraries
+from eps_noms_lazy import LazyModule
+
+google_exceptions = LazyModule('google.api_core.exceptions')
+requests = LazyModule('requests')
+
+# Config
+GCS_HOST = 'storage.googleapis.com'
+BIGQUERY_HOST = 'bigquery.googleapis.com'
+GCS_TIMEOUT = 60  # Seconds per request to the bucket
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1  # Seconds, doubled after each failed attempt
+RETRY_MAX_DELAY = 60
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+HOST_CONCURRENCY = 4  # Calls in flight to any one host
+CIRCUIT_FAILURE_THRESHOLD = 5  # Failed attempts in a row before a host's circuit opens
+CIRCUIT_RESET_TIMEOUT = 300  # Seconds an open circuit fails fast before a call is let through again
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of calling a host whose circuit breaker is open.
+    """
+
+def is_transient_error(error):
+    """
+    Whether a failed network call is worth retrying: dropped connections,
+    timeouts, throttling and server errors, but not 404s or bad requests.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUS_CODES
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                          ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, google_exceptions.GoogleAPICallError):
+        return error.code in RETRY_STATUS_CODES
+    return False
+
+def get_retry_after(error):
+    """
+    Seconds asked for by a Retry-After header on a throttled response, if any.
+    """
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After', '') if response is not None else ''
+    return int(value) if value.isdigit() else 0
+
+class Transport:
+    """
+    Retry policy shared by every network call to NHS, GCS and BigQuery:
+    - Transient failures are retried with jittered exponential backoff
+    - At most host_concurrency calls are in flight to each host
+    - After failure_threshold failed attempts in a row, a host's circuit
+      opens and calls fail fast with CircuitOpenError for reset_timeout
+      seconds, then one call is let through to test it again
+    Retries are counted per host and per thread, for the run metrics.
+    """
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 host_concurrency=HOST_CONCURRENCY, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.host_concurrency = host_concurrency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retries = {}
+        self._hosts = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get_host(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = {
+                    'semaphore': threading.BoundedSemaphore(self.host_concurrency),
+                    'failures': 0,
+                    'opened_at': None,
+                }
+            return self._hosts[host]
+
+    def _check_circuit(self, host, state):
+        with self._lock:
+            if state['opened_at'] is None:
+                return
+            if time.monotonic() - state['opened_at'] < self.reset_timeout:
+                raise CircuitOpenError(f"Circuit open for {host} after {state['failures']} failures")
+            # Half open: let this call through, a failure reopens the circuit
+            state['opened_at'] = None
+
+    def _record_result(self, host, state, ok):
+        with self._lock:
+            if ok:
+                state['failures'] = 0
+                return
+            state['failures'] += 1
+            if state['failures'] >= self.failure_threshold and state['opened_at'] is None:
+                state['opened_at'] = time.monotonic()
+                print(f"Circuit opened for {host} after {state['failures']} failures, "
+                      f"failing fast for {self.reset_timeout}s")
+
+    def _record_retry(self, host):
+        with self._lock:
+            self.retries[host] = self.retries.get(host, 0) + 1
+        self._local.retries = self.thread_retries() + 1
+
+    def thread_retries(self):
+        """
+        Retries made so far by the calling thread.
+        """
+        return getattr(self._local, 'retries', 0)
+
+    def backoff(self, attempt):
+        """
+        Full jitter: a random delay up to base_delay * 2^(attempt - 1), capped at max_delay.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, host, function, *args, **kwargs):
+        """
+        Call function(*args, **kwargs) against host with retries.
+        The last error is raised once the attempts run out, or straight away
+        if it is not transient.
+        """
+        state = self._get_host(host)
+        for attempt in range(1, self.attempts + 1):
+            self._check_circuit(host, state)
+            try:
+                with state['semaphore']:
+                    result = function(*args, **kwargs)
+            except Exception as e:
+                if not is_transient_error(e):
+                    raise
+                self._record_result(host, state, False)
+                if attempt == self.attempts:
+                    raise
+                delay = min(max(self.backoff(attempt), get_retry_after(e)), self.max_delay)
+                print(f"{host} call failed ({e}), retrying in {delay:.1f}s ({attempt}/{self.attempts - 1})")
+                self._record_retry(host)
+                time.sleep(delay)
+            else:
+                self._record_result(host, state, True)
+                return result
+
+transport = Transport()